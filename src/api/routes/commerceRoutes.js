@@ -25,7 +25,7 @@ async function forwardJsonOrText(upstreamRes) {
 // Deals Route (Amazon to Google Shopping)
 router.post("/deals", async (req, res) => {
   try {
-    const { category = "", limit } = req.body || {};
+    const { category = "", limit, cursor } = req.body || {};
     if (!category) {
       return res.status(400).json({ error: "category is required" });
     }
@@ -35,6 +35,7 @@ router.post("/deals", async (req, res) => {
 
     const qs = new URLSearchParams({ match_coll });
     if (limit != null) qs.set("limit", String(limit));
+    if (cursor) qs.set("cursor", String(cursor));
 
     const url = `${process.env.PYAPI_URL}/deals/google?${qs.toString()}`;
 
@@ -49,6 +50,31 @@ router.post("/deals", async (req, res) => {
   }
 });
 
+// Deals across categories (one upstream call, merged by savings)
+router.post("/deals/all", async (req, res) => {
+  try {
+    const { categories, limit, cursor } = req.body || {};
+
+    const qs = new URLSearchParams();
+    if (Array.isArray(categories) && categories.length) {
+      qs.set("match_colls", categories.map((c) => `match_${slugify(c)}`).join(","));
+    }
+    if (limit != null) qs.set("limit", String(limit));
+    if (cursor) qs.set("cursor", String(cursor));
+
+    const url = `${process.env.PYAPI_URL}/deals/google/all?${qs.toString()}`;
+
+    const upstream = await fetch(url);
+    const payload = await forwardJsonOrText(upstream);
+
+    return res.status(upstream.status).json(payload);
+
+  } catch (err) {
+    console.error("Proxy error (deals/google/all):", err);
+    return res.status(500).json({ error: "Failed to fetch Google deals" });
+  }
+});
+
 module.exports = router;
 
 
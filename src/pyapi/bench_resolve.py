@@ -0,0 +1,185 @@
+"""
+Benchmark for merchant link resolution scoring (services.provider_google_search)
+
+Compares the old two-loop difflib.SequenceMatcher scoring with the batched
+RapidFuzz ranker (services.link_candidates + utils.rank_candidates) on
+Google Search SERP payloads, and reports CPU time per call and how often
+both pick the same link. No network calls.
+
+Recorded payloads: pass SerpAPI "engine=google" JSON responses as files,
+each optionally wrapped as {"query": ..., "expected_title": ...,
+"expected_price": ..., "response": {...}}. Without files, realistic
+synthetic payloads are generated.
+
+Run:
+    python bench_resolve.py [payload.json ...] [--calls N]
+"""
+
+import sys
+import json
+import time
+import random
+import difflib
+
+from services import link_candidates, LINK_MIN_SCORE
+from utils import parse_price, extract_price_from_text, rank_candidates
+
+
+# ---------------------------------------------------------------------
+# 1. Previous implementation (scoring part, copied verbatim)
+# ---------------------------------------------------------------------
+
+def legacy_resolve(data: dict, query: str, expected_title: str, expected_price):
+    domain = query.split(" ")[0].lower()
+    expected_title_norm = expected_title.lower().strip()
+
+    best_score = -1
+    best_link = None
+
+    for r in data.get("shopping_results") or []:
+        link = r.get("link")
+        title = (r.get("title") or "").lower()
+        price = parse_price(r.get("extracted_price") or r.get("price"))
+        source = (r.get("source") or "").lower()
+        if not link:
+            continue
+        if domain not in source:
+            continue
+        title_sim = difflib.SequenceMatcher(None, title, expected_title_norm).ratio()
+        price_sim = 0
+        if expected_price and price:
+            diff_pct = abs(price - expected_price) / max(expected_price, 1)
+            price_sim = max(0, 1 - diff_pct)
+        score = (title_sim * 0.75) + (price_sim * 0.25)
+        if score > best_score:
+            best_score = score
+            best_link = link
+
+    if best_link and best_score >= 0.40:
+        return best_link
+
+    for r in data.get("organic_results") or []:
+        link = r.get("link")
+        title = (r.get("title") or "").lower()
+        snippet = r.get("snippet", "")
+        if not link:
+            continue
+        if domain not in link.lower():
+            continue
+        title_sim = difflib.SequenceMatcher(None, title, expected_title_norm).ratio()
+        found_price = extract_price_from_text(title + " " + snippet)
+        price_sim = 0
+        if expected_price and found_price:
+            diff_pct = abs(found_price - expected_price) / max(expected_price, 1)
+            price_sim = max(0, 1 - diff_pct)
+        score = (title_sim * 0.70) + (price_sim * 0.30)
+        if score > best_score:
+            best_score = score
+            best_link = link
+
+    return best_link if best_score >= 0.40 else None
+
+def batched_resolve(data: dict, query: str, expected_title: str, expected_price):
+    # Same selection as provider_google_search, minus the SERP call
+    domain = query.split(" ")[0].lower()
+    ranked = rank_candidates(link_candidates(data, domain), expected_title, expected_price)
+    for kind in ("shopping", "organic"):
+        best = next((c for c in ranked if c["kind"] == kind), None)
+        if best and best["score"] >= LINK_MIN_SCORE:
+            return best["link"]
+    return None
+
+
+# ---------------------------------------------------------------------
+# 2. Payloads (recorded files or synthetic)
+# ---------------------------------------------------------------------
+
+DOMAINS = ["walmart.com", "target.com", "bestbuy.com", "microcenter.com", "ebay.com"]
+WORDS = ["Logitech", "G502", "HERO", "Wired", "Gaming", "Mouse", "Black", "Wireless",
+         "Keyboard", "Mechanical", "RGB", "Sony", "WH-1000XM5", "Noise", "Canceling",
+         "Headphones", "Ninja", "Air", "Fryer", "4-Quart", "Stainless", "Steel", "Pro"]
+
+def load_recorded(path: str) -> dict:
+    with open(path) as f:
+        raw = json.load(f)
+    if "response" in raw:
+        return raw
+    params = raw.get("search_parameters") or {}
+    query = params.get("q") or "example.com product"
+    return {"query": query, "expected_title": query.split(" ", 1)[-1], "expected_price": None, "response": raw}
+
+def make_payload(rnd: random.Random) -> dict:
+    domain = rnd.choice(DOMAINS)
+    title = " ".join(rnd.sample(WORDS, rnd.randint(5, 10)))
+    price = round(rnd.uniform(10, 400), 2)
+
+    def variant():
+        words = title.split()
+        rnd.shuffle(words)
+        return " ".join(words[: rnd.randint(3, len(words))]) + " - " + rnd.choice(["New", "Renewed", "2 Pack", ""])
+
+    shopping = [{
+        "title": variant(),
+        "extracted_price": round(price * rnd.uniform(0.7, 1.3), 2),
+        "source": rnd.choice(DOMAINS + [domain] * 3),
+        "link": f"https://shop.example/{i}",
+    } for i in range(rnd.randint(10, 40))]
+
+    organic = [{
+        "title": variant() + " | " + rnd.choice(DOMAINS),
+        "snippet": f"Buy now for ${round(price * rnd.uniform(0.8, 1.2), 2)}. Free shipping on orders over $35. " * 2,
+        "link": f"https://www.{rnd.choice(DOMAINS + [domain])}/ip/{i}",
+    } for i in range(rnd.randint(8, 10))]
+
+    return {
+        "query": f"{domain} {title}",
+        "expected_title": title,
+        "expected_price": price,
+        "response": {"shopping_results": shopping, "organic_results": organic},
+    }
+
+
+# ---------------------------------------------------------------------
+# 3. Timing
+# ---------------------------------------------------------------------
+
+def cpu(fn, payloads: list, calls: int) -> float:
+    start = time.process_time()
+    for i in range(calls):
+        p = payloads[i % len(payloads)]
+        fn(p["response"], p["query"], p["expected_title"], p["expected_price"])
+    return time.process_time() - start
+
+def main():
+    args = sys.argv[1:]
+    calls = 2000
+    if "--calls" in args:
+        i = args.index("--calls")
+        calls = int(args[i + 1])
+        del args[i:i + 2]
+
+    if args:
+        payloads = [load_recorded(p) for p in args]
+        source = f"{len(payloads)} recorded payloads"
+    else:
+        rnd = random.Random(11)
+        payloads = [make_payload(rnd) for _ in range(200)]
+        source = f"{len(payloads)} synthetic payloads"
+
+    same = sum(
+        legacy_resolve(p["response"], p["query"], p["expected_title"], p["expected_price"])
+        == batched_resolve(p["response"], p["query"], p["expected_title"], p["expected_price"])
+        for p in payloads
+    )
+    print(f"{source}: same link chosen for {same}/{len(payloads)}")
+
+    old = cpu(legacy_resolve, payloads, calls)
+    new = cpu(batched_resolve, payloads, calls)
+    print(f"\n{calls} resolutions")
+    print(f"  difflib (old) : {old:7.3f}s CPU  ({old / calls * 1e3:6.3f} ms/call)")
+    print(f"  rapidfuzz     : {new:7.3f}s CPU  ({new / calls * 1e3:6.3f} ms/call)  x{old / new:.1f}")
+    print(f"  saved per call: {(old - new) / calls * 1e3:.3f} ms CPU")
+
+
+if __name__ == "__main__":
+    main()
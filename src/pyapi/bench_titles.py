@@ -0,0 +1,131 @@
+"""
+Micro-benchmark for title analysis (titles.py)
+
+Compares the old per-call regex code (4 x re.search in the scrape filter,
+re.sub in norm(), SIZE_RE scan in extract_size_and_count) against
+titles.analyze_title, cold (empty memo) and warm (titles seen before,
+which is the common case: offers repeat across requests/refreshes).
+
+Also checks both implementations give identical answers.
+
+Run:
+    python bench_titles.py [n_titles] [rounds]
+"""
+
+import re
+import sys
+import time
+import random
+
+from titles import analyze_title, _analyze, STOPWORDS, SIZE_RE, to_grams
+
+
+# ---------------------------------------------------------------------
+# 1. Previous implementation (copied verbatim, used as the baseline)
+# ---------------------------------------------------------------------
+
+def legacy_is_multipack(title: str) -> bool:
+    t = title.lower()
+    if "pack of" in t:
+        return True
+    if re.search(r"\b\d+\s*(pack|packet|bundle|variety|ct|count)\b", t):
+        return True
+    if re.search(r"\b\d+\s*pk\b", t):
+        return True
+    if re.search(r"\b\d+\s*x\s*\d+", t):
+        return True
+    return False
+
+def legacy_norm(s: str) -> str:
+    if not s:
+        return ""
+    s = re.sub(r"[^a-z0-9 ]+", " ", s.lower())
+    toks = [t for t in s.split() if t and t not in STOPWORDS]
+    return " ".join(toks)
+
+def legacy_size_and_count(title: str) -> dict:
+    grams = None
+    count = 1
+    if not title:
+        return {"grams": None, "count": 1}
+    for m in SIZE_RE.finditer(title):
+        qty, unit, pack_of, ct_alt, pack_alt = m.groups()
+        if qty and unit:
+            g = to_grams(float(qty), unit)
+            if g:
+                grams = max(grams or 0, g)
+        for v in (pack_of, ct_alt, pack_alt):
+            if v and v.isdigit():
+                count = max(count, int(v))
+    return {"grams": grams, "count": count}
+
+def legacy(title: str):
+    # What scrape + scoring used to do for one title
+    return legacy_is_multipack(title), legacy_norm(title), legacy_size_and_count(title)
+
+def current(title: str):
+    info = analyze_title(title)
+    return info.multipack, info.norm, {"grams": info.grams, "count": info.count}
+
+
+# ---------------------------------------------------------------------
+# 2. Synthetic but realistic titles
+# ---------------------------------------------------------------------
+
+BRANDS = ["Oral-B", "Cheerios", "Hanes", "Anker", "Tide", "Lysol", "Nature Valley", "Kirkland"]
+NOUNS = ["Toothpaste", "Cereal", "Crew Socks", "USB-C Charger", "Laundry Detergent",
+         "Disinfectant Wipes", "Granola Bars", "Paper Towels", "Coffee Pods"]
+SIZES = ["12 oz", "1.5 lb", "500 ml", "2 L", "16.9 fl oz", "64 Count", "3-Pack",
+         "Pack of 6", "24 ct", "4pk", "2 x 16 oz", ""]
+EXTRAS = ["Original", "Family Size", "with Fluoride", "for Men", "Fast Charging, 20W",
+          "(Assorted Flavors)", "- Value Bundle", "Unscented", ""]
+
+def make_titles(n: int, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    return [
+        " ".join(filter(None, [
+            rnd.choice(BRANDS), rnd.choice(NOUNS), rnd.choice(EXTRAS), rnd.choice(SIZES),
+        ]))
+        + f" #{i}"
+        for i in range(n)
+    ]
+
+
+# ---------------------------------------------------------------------
+# 3. Timing
+# ---------------------------------------------------------------------
+
+def timed(fn, titles: list, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for t in titles:
+            fn(t)
+    return time.perf_counter() - start
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    titles = make_titles(n)
+
+    # Same answers
+    mismatches = [t for t in titles if legacy(t) != current(t)]
+    print(f"Checked {len(titles)} titles, mismatches: {len(mismatches)}")
+    for t in mismatches[:5]:
+        print("  ", t, legacy(t), current(t))
+
+    base = timed(legacy, titles, rounds)
+
+    _analyze.cache_clear()
+    cold = timed(current, titles, 1) * rounds
+
+    warm = timed(current, titles, rounds)
+
+    calls = n * rounds
+    print(f"\n{calls} title analyses ({n} distinct titles x {rounds} rounds)")
+    print(f"  legacy        : {base:8.3f}s  ({base / calls * 1e6:6.2f} us/title)")
+    print(f"  analyze, cold : {cold:8.3f}s  ({cold / calls * 1e6:6.2f} us/title)  x{base / cold:.1f}")
+    print(f"  analyze, warm : {warm:8.3f}s  ({warm / calls * 1e6:6.2f} us/title)  x{base / warm:.1f}")
+
+
+if __name__ == "__main__":
+    main()
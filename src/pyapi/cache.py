@@ -0,0 +1,412 @@
+import os, json, math, time, asyncio, hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from store import ensure_indexes
+from titles import analyze_title
+
+# In-Process LRU + TTL Cache
+class TTLCache:
+    """
+    Small LRU cache where every entry also carries an expiry time.
+
+    - get() returns None for missing/expired keys
+    - set() evicts the least-recently-used entry once `maxsize` is hit
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# Optional MongoDB Tier
+class MongoCacheTier:
+    """
+    Second cache level stored in a MongoDB collection.
+
+    Documents look like:
+      { "_id": key, "value": "<json>", "expires_at": datetime }
+
+    Values are stored as a JSON string so arbitrary SerpAPI keys
+    (dots, dollars) never collide with Mongo field rules. A TTL
+    index on `expires_at` lets Mongo purge expired entries itself.
+    """
+
+    def __init__(self, coll):
+        self.coll = coll
+
+    async def get(self, key: str) -> Optional[Any]:
+        doc = await self.coll.find_one({"_id": key})
+        if not doc:
+            return None
+        expires_at = doc.get("expires_at")
+        if expires_at is not None:
+            # Motor returns naive datetimes (UTC) unless tz_aware is set
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            if expires_at < datetime.now(timezone.utc):
+                return None
+        return json.loads(doc["value"])
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await ensure_indexes(self.coll, "cache")
+        await self.coll.update_one(
+            {"_id": key},
+            {"$set": {
+                "value": json.dumps(value),
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+            }},
+            upsert=True,
+        )
+
+# SerpAPI Response Cache
+# Per-engine TTLs (seconds). 0 disables caching for that engine.
+SERP_CACHE_TTLS: Dict[str, float] = {
+    "google_shopping": float(os.getenv("SERP_CACHE_TTL_GOOGLE_SHOPPING", "21600")),
+    "google": float(os.getenv("SERP_CACHE_TTL_GOOGLE", "86400")),
+    "amazon": float(os.getenv("SERP_CACHE_TTL_AMAZON", "43200")),
+}
+SERP_CACHE_DEFAULT_TTL = float(os.getenv("SERP_CACHE_TTL_DEFAULT", "0"))
+SERP_CACHE_MAXSIZE = int(os.getenv("SERP_CACHE_MAXSIZE", "2048"))
+
+# Params that never affect the response body
+_IGNORED_PARAMS = {"api_key", "no_cache", "async", "output"}
+
+def _norm_value(v) -> str:
+    """Lowercase + collapse whitespace so "Foo  Bar" and "foo bar" share a key."""
+    return " ".join(str(v).lower().split())
+
+def serp_cache_key(url: str, params: dict) -> str:
+    """
+    Build a stable cache key from engine + normalized params.
+
+    Example: google_shopping:3f2a... (sha1 of the sorted params)
+    """
+    engine = params.get("engine") or "unknown"
+    items = sorted(
+        (k, _norm_value(v))
+        for k, v in params.items()
+        if k not in _IGNORED_PARAMS and v is not None
+    )
+    raw = url + "?" + "&".join(f"{k}={v}" for k, v in items)
+    return f"{engine}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+class SerpCache:
+    """
+    Two-level response cache in front of serp_get.
+
+    - L1: in-process TTLCache (always on)
+    - L2: MongoCacheTier (only once attach_mongo() is called)
+    - Tracks hits/misses per engine for /debug/cache-stats
+    """
+
+    def __init__(self, maxsize: int = SERP_CACHE_MAXSIZE):
+        self.memory = TTLCache(maxsize)
+        self.mongo: Optional[MongoCacheTier] = None
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def attach_mongo(self, coll):
+        self.mongo = MongoCacheTier(coll)
+
+    def ttl_for(self, engine: str) -> float:
+        return SERP_CACHE_TTLS.get(engine, SERP_CACHE_DEFAULT_TTL)
+
+    def _count(self, engine: str, field: str):
+        s = self.stats.setdefault(engine, {"hits": 0, "mongo_hits": 0, "misses": 0})
+        s[field] += 1
+
+    async def get(self, key: str, engine: str) -> Optional[Any]:
+        if self.ttl_for(engine) <= 0:
+            return None
+
+        value = self.memory.get(key)
+        if value is not None:
+            self._count(engine, "hits")
+            return value
+
+        if self.mongo is not None:
+            try:
+                value = await self.mongo.get(key)
+            except Exception as e:
+                print("Serp cache (mongo) ERROR:", e)
+                value = None
+            if value is not None:
+                # Promote into L1 for the remainder of the TTL window
+                self.memory.set(key, value, self.ttl_for(engine))
+                self._count(engine, "mongo_hits")
+                return value
+
+        self._count(engine, "misses")
+        return None
+
+    async def set(self, key: str, engine: str, value: Any):
+        ttl = self.ttl_for(engine)
+        if ttl <= 0:
+            return
+        self.memory.set(key, value, ttl)
+        if self.mongo is not None:
+            try:
+                await self.mongo.set(key, value, ttl)
+            except Exception as e:
+                print("Serp cache (mongo) ERROR:", e)
+
+    def snapshot(self) -> dict:
+        engines = {}
+        for engine, s in self.stats.items():
+            total = s["hits"] + s["mongo_hits"] + s["misses"]
+            engines[engine] = {
+                **s,
+                "hit_ratio": round((s["hits"] + s["mongo_hits"]) / total, 4) if total else 0.0,
+                "ttl_seconds": self.ttl_for(engine),
+            }
+        return {
+            "memory_entries": len(self.memory),
+            "mongo_enabled": self.mongo is not None,
+            "engines": engines,
+        }
+
+# Module-level instance shared by services.serp_get
+serp_cache = SerpCache()
+
+# Two-Level Cache of short strings, with negative entries
+# Stored in L1 for keys whose lookup failed
+_NEGATIVE = ""
+
+class ValueCache:
+    """
+    Two-level cache of key -> string value (or None = known failure).
+
+    - L1: in-process TTLCache
+    - L2: MongoDB collection { _id: key, <field>: value | None, expires_at }
+    - Failures are cached too (value None) with a shorter TTL
+      so a dead lookup is not retried on every request
+
+    get() returns (found, value_or_None). get_many() / set_many() do the
+    same for a whole batch with one $in query / one bulk_write.
+    """
+
+    def __init__(self, label: str, field: str, ttl: float, negative_ttl: float, maxsize: int):
+        self.label = label
+        self.field = field
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = TTLCache(maxsize)
+        self.coll = None
+        self.stats = {"hits": 0, "mongo_hits": 0, "negative_hits": 0, "misses": 0}
+        self._pending: List[UpdateOne] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def attach_mongo(self, coll):
+        self.coll = coll
+
+    def _hit(self, value: str, field: str) -> Tuple[bool, Optional[str]]:
+        if value == _NEGATIVE:
+            self.stats["negative_hits"] += 1
+            return True, None
+        self.stats[field] += 1
+        return True, value
+
+    def _promote(self, doc: dict) -> Optional[str]:
+        """L2 doc -> L1 entry; returns the stored value, or None if expired."""
+        expires_at = doc.get("expires_at")
+        if expires_at is not None and expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        now = datetime.now(timezone.utc)
+        if expires_at is not None and expires_at <= now:
+            return None
+        value = doc.get(self.field) or _NEGATIVE
+        ttl = (expires_at - now).total_seconds() if expires_at else self.ttl
+        self.memory.set(doc["_id"], value, ttl)
+        return value
+
+    async def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        value = self.memory.get(key)
+        if value is not None:
+            return self._hit(value, "hits")
+
+        if self.coll is not None:
+            try:
+                doc = await self.coll.find_one({"_id": key}, {self.field: 1, "expires_at": 1})
+            except Exception as e:
+                print(f"{self.label} cache (mongo) ERROR:", e)
+                doc = None
+
+            value = self._promote(doc) if doc else None
+            if value is not None:
+                return self._hit(value, "mongo_hits")
+
+        self.stats["misses"] += 1
+        return False, None
+
+    async def get_many(self, keys: List[str], timeout: Optional[float] = None) -> Dict[str, Optional[str]]:
+        """
+        Cached entries among `keys` (value None = known failure); misses are
+        left out. One $in query for everything not in L1; if it takes longer
+        than `timeout` those keys count as misses.
+        """
+        found: Dict[str, Optional[str]] = {}
+        missing = []
+        for key in keys:
+            value = self.memory.get(key)
+            if value is not None:
+                found[key] = self._hit(value, "hits")[1]
+            else:
+                missing.append(key)
+
+        if missing and self.coll is not None:
+            try:
+                docs = await asyncio.wait_for(
+                    self.coll.find({"_id": {"$in": missing}}, {self.field: 1, "expires_at": 1}).to_list(None),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                print(f"{self.label} cache (mongo) lookup timed out")
+                docs = []
+            except Exception as e:
+                print(f"{self.label} cache (mongo) ERROR:", e)
+                docs = []
+
+            for doc in docs:
+                value = self._promote(doc)
+                if value is not None:
+                    found[doc["_id"]] = self._hit(value, "mongo_hits")[1]
+
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def _store(self, key: str, value: Optional[str]) -> dict:
+        """Put `key` in L1 and return the matching L2 update."""
+        ttl = self.ttl if value else self.negative_ttl
+        self.memory.set(key, value or _NEGATIVE, ttl)
+        return {"$set": {
+            self.field: value,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+        }}
+
+    async def set(self, key: str, value: Optional[str]):
+        update = self._store(key, value)
+
+        if self.coll is not None:
+            try:
+                await ensure_indexes(self.coll, "cache")
+                await self.coll.update_one({"_id": key}, update, upsert=True)
+            except Exception as e:
+                print(f"{self.label} cache (mongo) ERROR:", e)
+
+    def set_many(self, values: Dict[str, Optional[str]]):
+        """
+        Store entries in L1 now; L2 writes run in the background, one
+        bulk_write at a time. Entries set while a write is in flight
+        (or in the same loop iteration) go out together in the next one.
+        """
+        for key, value in values.items():
+            update = self._store(key, value)
+            if self.coll is not None:
+                self._pending.append(UpdateOne({"_id": key}, update, upsert=True))
+
+        if self._pending and self._writer is None:
+            self._writer = asyncio.ensure_future(self._drain())
+
+    async def _drain(self):
+        try:
+            while self._pending:
+                ops, self._pending = self._pending, []
+                try:
+                    await ensure_indexes(self.coll, "cache")
+                    await self.coll.bulk_write(ops, ordered=False)
+                except Exception as e:
+                    print(f"{self.label} cache (mongo) ERROR:", e)
+        finally:
+            self._writer = None
+
+    def snapshot(self) -> dict:
+        s = self.stats
+        total = s["hits"] + s["mongo_hits"] + s["negative_hits"] + s["misses"]
+        return {
+            **s,
+            "hit_ratio": round((total - s["misses"]) / total, 4) if total else 0.0,
+            "memory_entries": len(self.memory),
+            "mongo_enabled": self.coll is not None,
+        }
+
+# Perceptual-Hash Cache (URL -> 64-bit pHash)
+PHASH_CACHE_TTL = float(os.getenv("PHASH_CACHE_TTL", str(30 * 86400)))
+PHASH_CACHE_NEGATIVE_TTL = float(os.getenv("PHASH_CACHE_NEGATIVE_TTL", "3600"))
+PHASH_CACHE_MAXSIZE = int(os.getenv("PHASH_CACHE_MAXSIZE", "20000"))
+
+class PhashCache(ValueCache):
+    """
+    Image URL -> pHash (16-char hex string), L2 docs { _id: url, h, expires_at }.
+    Failed downloads are cached as None for PHASH_CACHE_NEGATIVE_TTL.
+    """
+
+    def __init__(self, maxsize: int = PHASH_CACHE_MAXSIZE):
+        super().__init__("pHash", "h", PHASH_CACHE_TTL, PHASH_CACHE_NEGATIVE_TTL, maxsize)
+
+# Module-level instance shared by utils.compute_phash
+phash_cache = PhashCache()
+
+# Merchant URL Resolution Cache ((domain, title, price bucket) -> product URL)
+RESOLVE_CACHE_TTL = float(os.getenv("RESOLVE_CACHE_TTL", str(7 * 86400)))
+RESOLVE_CACHE_NEGATIVE_TTL = float(os.getenv("RESOLVE_CACHE_NEGATIVE_TTL", str(6 * 3600)))
+RESOLVE_CACHE_MAXSIZE = int(os.getenv("RESOLVE_CACHE_MAXSIZE", "20000"))
+# Prices within the same ~10% band share an entry
+RESOLVE_PRICE_BUCKET_PCT = float(os.getenv("RESOLVE_PRICE_BUCKET_PCT", "10"))
+
+def _normalize_domain(domain: str) -> str:
+    d = domain.lower().strip()
+    d = d.split("://", 1)[-1].split("/", 1)[0]
+    return d[4:] if d.startswith("www.") else d
+
+def price_bucket(price: Any) -> Optional[int]:
+    """Log-scale bucket: every bucket spans RESOLVE_PRICE_BUCKET_PCT percent."""
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        return None
+    if price <= 0:
+        return None
+    return math.floor(math.log(price) / math.log1p(RESOLVE_PRICE_BUCKET_PCT / 100))
+
+def resolve_cache_key(domain: str, title: str, price: Any = None) -> str:
+    """Normalized domain + normalized title + price bucket."""
+    raw = json.dumps([_normalize_domain(domain), analyze_title(title).norm, price_bucket(price)])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+class ResolveCache(ValueCache):
+    """
+    Resolved merchant product URLs, L2 docs { _id: key, url, expires_at }.
+    Unresolved lookups are cached as None for RESOLVE_CACHE_NEGATIVE_TTL.
+    """
+
+    def __init__(self, maxsize: int = RESOLVE_CACHE_MAXSIZE):
+        super().__init__("resolve", "url", RESOLVE_CACHE_TTL, RESOLVE_CACHE_NEGATIVE_TTL, maxsize)
+
+# Module-level instance shared by /extension/resolve-merchant-url
+resolve_cache = ResolveCache()
@@ -0,0 +1,171 @@
+import os, math, time, asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Set
+from pymongo import UpdateOne
+from models import Offer
+from store import ensure_indexes
+from titles import analyze_title
+
+# Local Offer Catalog
+# Every Google Shopping offer we fetch is kept (in memory + Mongo) with an
+# inverted index over its normalized title tokens (same norm() as scoring),
+# so a product seen recently can be answered without calling SerpAPI.
+OFFER_CATALOG_MAX_ITEMS = int(os.getenv("OFFER_CATALOG_MAX_ITEMS", "200000"))
+# Local answers only use offers seen within this window
+OFFER_CATALOG_MAX_AGE_S = float(os.getenv("OFFER_CATALOG_MAX_AGE_S", str(6 * 3600)))
+# Mongo keeps offers this long (TTL), restarts reload what is still fresh
+OFFER_CATALOG_RETENTION_S = float(os.getenv("OFFER_CATALOG_RETENTION_S", str(7 * 24 * 3600)))
+# Share of the query's tokens a candidate title must contain
+OFFER_CATALOG_MIN_OVERLAP = float(os.getenv("OFFER_CATALOG_MIN_OVERLAP", "0.6"))
+OFFER_CATALOG_MAX_CANDIDATES = int(os.getenv("OFFER_CATALOG_MAX_CANDIDATES", "40"))
+# Local answer is used when it yields at least this many deals, else SerpAPI
+OFFER_CATALOG_MIN_DEALS = int(os.getenv("OFFER_CATALOG_MIN_DEALS", "1"))
+# Tokens on more offers than this ("black", "new") don't generate candidates
+OFFER_CATALOG_MAX_POSTING = int(os.getenv("OFFER_CATALOG_MAX_POSTING", "5000"))
+
+OFFER_FIELDS = ("merchant", "source_domain", "title", "price", "thumbnail", "brand", "url")
+
+class OfferCatalog:
+    """
+    url -> offer, plus token -> {url} postings.
+
+    - add(): called with every provider_google_shopping result
+      (the Mongo write runs in the background)
+    - lookup(): fresh offers sharing most of the query's tokens,
+      best overlap first; pure in-memory
+    - load(): fills memory from Mongo at startup
+
+    Offers coming out of the SerpAPI response cache are re-stamped as
+    seen, so an offer can be up to one SERP cache TTL older than
+    OFFER_CATALOG_MAX_AGE_S says.
+    """
+
+    def __init__(self, maxsize: int = OFFER_CATALOG_MAX_ITEMS):
+        self.maxsize = maxsize
+        self.offers: "OrderedDict[str, dict]" = OrderedDict()
+        self.postings: Dict[str, Set[str]] = {}
+        self.coll = None
+        self._writes: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def attach_mongo(self, coll):
+        self.coll = coll
+
+    def _unindex(self, url: str, entry: dict):
+        for tok in entry["tokens"]:
+            urls = self.postings.get(tok)
+            if urls is not None:
+                urls.discard(url)
+                if not urls:
+                    del self.postings[tok]
+
+    def _put(self, offer: dict, seen_at: float):
+        url = offer["url"]
+        old = self.offers.pop(url, None)
+        if old is not None:
+            self._unindex(url, old)
+
+        tokens = set(analyze_title(offer["title"]).tokens)
+        self.offers[url] = {
+            "offer": {k: offer.get(k) for k in OFFER_FIELDS},
+            "tokens": tokens,
+            "seen_at": seen_at,
+        }
+        for tok in tokens:
+            self.postings.setdefault(tok, set()).add(url)
+
+        # Evict least recently seen
+        while len(self.offers) > self.maxsize:
+            old_url, old_entry = self.offers.popitem(last=False)
+            self._unindex(old_url, old_entry)
+
+    def add(self, offers: List[Offer]):
+        now = time.time()
+        fresh = [o for o in offers if o.get("url") and o.get("title") and o.get("price") is not None]
+        for o in fresh:
+            self._put(o, now)
+
+        if self.coll is not None and fresh:
+            task = asyncio.ensure_future(self._persist(fresh, now))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _persist(self, offers: List[dict], seen_at: float):
+        seen = datetime.fromtimestamp(seen_at, timezone.utc)
+        expires_at = seen + timedelta(seconds=OFFER_CATALOG_RETENTION_S)
+        try:
+            await ensure_indexes(self.coll, "catalog")
+            await self.coll.bulk_write([
+                UpdateOne(
+                    {"_id": o["url"]},
+                    {"$set": {
+                        **{k: o.get(k) for k in OFFER_FIELDS},
+                        "seen_at": seen,
+                        "expires_at": expires_at,
+                    }},
+                    upsert=True,
+                )
+                for o in offers
+            ], ordered=False)
+        except Exception as e:
+            print("Offer catalog write ERROR:", e)
+
+    async def load(self) -> int:
+        """Load the newest offers still inside the freshness window from Mongo."""
+        if self.coll is None:
+            return 0
+        await ensure_indexes(self.coll, "catalog")
+        since = datetime.now(timezone.utc) - timedelta(seconds=OFFER_CATALOG_MAX_AGE_S)
+        docs = await self.coll.find({"seen_at": {"$gte": since}}) \
+            .sort([("seen_at", -1)]).limit(self.maxsize).to_list(self.maxsize)
+
+        # Oldest first, so memory order (= eviction order) is by seen_at
+        for doc in reversed(docs):
+            seen = doc["seen_at"]
+            if seen.tzinfo is None:
+                seen = seen.replace(tzinfo=timezone.utc)
+            self._put(doc, seen.timestamp())
+        return len(docs)
+
+    def lookup(
+        self,
+        title: str,
+        max_age_s: float = OFFER_CATALOG_MAX_AGE_S,
+        limit: int = OFFER_CATALOG_MAX_CANDIDATES,
+    ) -> List[Offer]:
+        tokens = set(analyze_title(title).tokens)
+        if not tokens:
+            return []
+
+        overlap: Dict[str, int] = {}
+        for tok in tokens:
+            urls = self.postings.get(tok)
+            if not urls or len(urls) > OFFER_CATALOG_MAX_POSTING:
+                continue
+            for url in urls:
+                overlap[url] = overlap.get(url, 0) + 1
+
+        need = max(1, math.ceil(len(tokens) * OFFER_CATALOG_MIN_OVERLAP))
+        fresh_after = time.time() - max_age_s
+        found = []
+        for url, n in overlap.items():
+            entry = self.offers[url]
+            if n >= need and entry["seen_at"] >= fresh_after:
+                found.append((n, entry["seen_at"], url))
+
+        found.sort(reverse=True)
+        return [Offer(**self.offers[url]["offer"]) for _, _, url in found[:limit]]
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "offers": len(self.offers),
+            "tokens": len(self.postings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+offer_catalog = OfferCatalog()
@@ -0,0 +1,63 @@
+import os
+from typing import Optional
+import httpx
+
+# Shared HTTP Client Settings
+# One pooled AsyncClient lives for the whole app so SerpAPI calls and
+# thumbnail downloads reuse TCP/TLS connections instead of handshaking
+# on every request.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in {"1", "true", "yes"}
+
+_client: Optional[httpx.AsyncClient] = None
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+    http2 = HTTP2_ENABLED
+    if http2 and not _http2_available():
+        print("HTTP2_ENABLED set but `h2` is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(limits=limits, http2=http2, timeout=10.0)
+
+# Lifecycle (wired to FastAPI startup/shutdown in main.py)
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared client (no-op if it already exists)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+async def close_http_client():
+    """Close the shared client and drop its pooled connections."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared client.
+
+    Created lazily so scripts/tests that never run the FastAPI
+    lifespan (e.g. debug_runner.py) still work.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
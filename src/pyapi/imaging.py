@@ -0,0 +1,99 @@
+import os, asyncio, multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List, Optional
+from PIL import Image
+import imagehash
+
+# Image Worker Pool Settings
+# "process" keeps JPEG decode + DCT off the event loop AND off the GIL,
+# "thread" is lighter (no fork) but still shares the GIL with uvicorn.
+PHASH_EXECUTOR = os.getenv("PHASH_EXECUTOR", "process").lower()
+PHASH_WORKERS = int(os.getenv("PHASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Draft decoding lets libjpeg decode at 1/2, 1/4 or 1/8 scale.
+# phash only looks at a 32x32 thumbnail, so 64px is plenty.
+PHASH_DRAFT_DECODE = os.getenv("PHASH_DRAFT_DECODE", "true").lower() in {"1", "true", "yes"}
+PHASH_DRAFT_SIZE = int(os.getenv("PHASH_DRAFT_SIZE", "64"))
+
+_pool: Optional[Executor] = None
+
+class ImagePoolError(Exception):
+    """The worker pool died mid-batch: no verdict on the images (don't cache)."""
+
+# Worker-side functions (must be top-level so they pickle)
+def phash_from_bytes(data: bytes, draft: bool = PHASH_DRAFT_DECODE) -> Optional[str]:
+    """
+    Decode image bytes and return the pHash as a 16-char hex string.
+    Returns None if the bytes are not a decodable image.
+    """
+    try:
+        img = Image.open(BytesIO(data))
+        if draft:
+            # No-op for non-JPEG formats
+            img.draft("RGB", (PHASH_DRAFT_SIZE, PHASH_DRAFT_SIZE))
+        return str(imagehash.phash(img.convert("RGB")))
+    except Exception:
+        return None
+
+def _phash_batch(blobs: List[bytes], draft: bool) -> List[Optional[str]]:
+    """Hash a whole batch inside one worker (one IPC round trip)."""
+    return [phash_from_bytes(b, draft) for b in blobs]
+
+# Pool Lifecycle (wired to FastAPI startup/shutdown in main.py)
+def _build_pool() -> Executor:
+    workers = max(1, PHASH_WORKERS)
+    if PHASH_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phash")
+    # forkserver: workers never fork the serving process (Motor/pymongo threads running)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+
+def start_image_pool() -> Executor:
+    global _pool
+    if _pool is None:
+        _pool = _build_pool()
+    return _pool
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+def get_image_pool() -> Executor:
+    """Return the pool, creating it lazily for scripts that skip the lifespan."""
+    return start_image_pool()
+
+# Async API
+async def phash_bytes_many(blobs: List[bytes], chunk_size: int = 8) -> List[Optional[str]]:
+    """
+    Batch submission: hash many images in the pool.
+
+    Blobs are split into chunks so several workers share the batch while
+    each chunk still costs a single pickle round trip.
+    Raises ImagePoolError if the pool broke (None means "not an image").
+    """
+    if not blobs:
+        return []
+
+    loop = asyncio.get_running_loop()
+    chunks = [blobs[i:i + chunk_size] for i in range(0, len(blobs), chunk_size)]
+
+    try:
+        pool = get_image_pool()
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(pool, _phash_batch, chunk, PHASH_DRAFT_DECODE)
+            for chunk in chunks
+        ])
+    except BrokenProcessPool as e:
+        # A worker died (OOM on a huge image etc.), rebuild for next time
+        print("pHash pool ERROR:", e)
+        shutdown_image_pool()
+        raise ImagePoolError(str(e)) from e
+
+    return [h for part in parts for h in part]
+
+async def phash_bytes(data: bytes) -> Optional[str]:
+    """Hash a single image in the pool."""
+    return (await phash_bytes_many([data]))[0]
@@ -0,0 +1,326 @@
+import os, time, uuid, asyncio
+from contextvars import ContextVar
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from pymongo import ReturnDocument
+from utils import now_utc
+
+# Background Job Engine
+# Long pipelines (full ingest) run as jobs: submit returns an id right away,
+# progress + checkpoints live in Mongo, and unfinished jobs are resumed
+# by whichever process finds them orphaned (periodic sweep).
+JOB_SAVE_INTERVAL_S = float(os.getenv("JOB_SAVE_INTERVAL_S", "2"))
+# A running job whose heartbeat is older than this is considered orphaned
+JOB_STALE_S = float(os.getenv("JOB_STALE_S", "120"))
+# Heartbeat of every running job, independent of its progress (<< JOB_STALE_S)
+JOB_HEARTBEAT_S = float(os.getenv("JOB_HEARTBEAT_S", "15"))
+# How often each process looks for orphaned jobs to claim
+JOB_SWEEP_S = float(os.getenv("JOB_SWEEP_S", "60"))
+
+# Identifies this process as the owner of the jobs it runs
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job once cancellation was requested. A BaseException
+    (like asyncio.CancelledError) so per-item `except Exception` handlers
+    in workers don't swallow it and it reaches the runner.
+    """
+
+class JobLost(JobCancelled):
+    """
+    Raised inside a job once another process owns it (it looked orphaned
+    and was claimed). The runner stops it without touching the job doc.
+    """
+
+# Job currently running in this task (lets serp_get count calls per job)
+current_job: ContextVar[Optional["JobContext"]] = ContextVar("current_job", default=None)
+
+def note_serp_call():
+    """Count one SerpAPI HTTP call against the running job (if any)."""
+    job = current_job.get()
+    if job is not None:
+        job.incr("serp_calls")
+
+class JobContext:
+    """
+    Handle passed to a job handler.
+
+    - progress: counters shown by GET /jobs/{id}
+    - checkpoint: whatever the handler needs to resume after a restart
+    - save(): persists both (throttled) and raises JobCancelled if
+      someone asked to cancel the job, JobLost if this process no
+      longer owns it
+    """
+
+    def __init__(self, runner: "JobRunner", doc: dict):
+        self.runner = runner
+        self.id = doc["_id"]
+        self.params = doc.get("params") or {}
+        self.progress: Dict[str, float] = doc.get("progress") or {}
+        self.checkpoint: dict = doc.get("checkpoint") or {}
+        self.stage: Optional[str] = doc.get("stage")
+        self.lost = False
+        self._saved_at = 0.0
+
+    def incr(self, field: str, n: int = 1):
+        self.progress[field] = self.progress.get(field, 0) + n
+
+    async def set_stage(self, stage: str, total: Optional[int] = None):
+        self.stage = stage
+        self.progress["stage_done"] = 0
+        self.progress["stage_total"] = total
+        self.progress["stage_started_at"] = time.time()
+        await self.save(force=True)
+
+    async def save(self, force: bool = False):
+        if not force and time.monotonic() - self._saved_at < JOB_SAVE_INTERVAL_S:
+            return
+        self._saved_at = time.monotonic()
+
+        doc = await self.runner.coll.find_one_and_update(
+            {"_id": self.id, "owner": INSTANCE_ID},
+            {"$set": {
+                "stage": self.stage,
+                "progress": self.progress,
+                "checkpoint": self.checkpoint,
+                "heartbeat_at": now_utc(),
+            }},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            self.lost = True
+            raise JobLost()
+        if doc.get("cancel_requested"):
+            raise JobCancelled()
+
+Handler = Callable[[JobContext], Awaitable[Optional[dict]]]
+
+class JobRunner:
+    """
+    Runs registered job kinds as asyncio tasks, backed by a Mongo collection.
+
+    Job doc:
+      { _id, kind, params, status, stage, progress, checkpoint, result,
+        error, owner, cancel_requested, created_at, started_at,
+        heartbeat_at, finished_at }
+    """
+
+    def __init__(self, coll):
+        self.coll = coll
+        self.handlers: Dict[str, Handler] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def register(self, kind: str, handler: Handler):
+        self.handlers[kind] = handler
+
+    async def submit(self, kind: str, params: dict) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        now = now_utc()
+        await self.coll.insert_one({
+            "_id": job_id,
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "progress": {},
+            "checkpoint": {},
+            "owner": INSTANCE_ID,
+            "created_at": now,
+            "heartbeat_at": now,
+        })
+        self._start(job_id)
+        return job_id
+
+    def _start(self, job_id: str):
+        task = asyncio.ensure_future(self._run(job_id))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _t: self.tasks.pop(job_id, None))
+
+    async def _finish(self, job_id: str, status: str, **fields):
+        # Owner filter: a process that lost the job never overwrites the new owner's doc
+        await self.coll.update_one(
+            {"_id": job_id, "owner": INSTANCE_ID},
+            {"$set": {"status": status, "finished_at": now_utc(), **fields}},
+        )
+
+    async def _heartbeat(self, ctx: JobContext, task: asyncio.Task):
+        """
+        Keep heartbeat_at fresh while the job runs, even with no progress
+        (long SerpAPI retries / limiter backoff). Stops the job when it was
+        cancelled elsewhere or another process took it over.
+        """
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_S)
+            try:
+                doc = await self.coll.find_one_and_update(
+                    {"_id": ctx.id, "owner": INSTANCE_ID},
+                    {"$set": {"heartbeat_at": now_utc()}},
+                    projection={"cancel_requested": 1},
+                )
+            except Exception as e:
+                print(f"Job {ctx.id} heartbeat ERROR:", e)
+                continue
+            if doc is None:
+                ctx.lost = True
+                task.cancel()
+                return
+            if doc.get("cancel_requested"):
+                task.cancel()
+                return
+
+    async def _run(self, job_id: str):
+        doc = await self.coll.find_one_and_update(
+            {"_id": job_id, "owner": INSTANCE_ID},
+            {"$set": {"status": "running", "started_at": now_utc(), "heartbeat_at": now_utc()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not doc:
+            return
+        ctx = JobContext(self, doc)
+        token = current_job.set(ctx)
+        beat = asyncio.ensure_future(self._heartbeat(ctx, asyncio.current_task()))
+
+        try:
+            try:
+                result = await self.handlers[doc["kind"]](ctx)
+                await ctx.save(force=True)
+            finally:
+                beat.cancel()
+            await self._finish(job_id, "done", result=result)
+        except asyncio.CancelledError:
+            if self._stopping:
+                # Process shutdown: leave it "running" so it gets resumed
+                raise
+            if ctx.lost:
+                print(f"Job {job_id} taken over by another process")
+                return
+            await self._finish(job_id, "cancelled", progress=ctx.progress, checkpoint=ctx.checkpoint)
+        except JobLost:
+            print(f"Job {job_id} taken over by another process")
+        except JobCancelled:
+            await self._finish(job_id, "cancelled", progress=ctx.progress, checkpoint=ctx.checkpoint)
+        except Exception as e:
+            print(f"Job {job_id} ERROR:", e)
+            await self._finish(job_id, "failed", error=str(e), progress=ctx.progress, checkpoint=ctx.checkpoint)
+        finally:
+            current_job.reset(token)
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Request cancellation. A job running in this process is cancelled
+        immediately; one running elsewhere stops at its next save() or
+        heartbeat (JOB_HEARTBEAT_S).
+        """
+        res = await self.coll.update_one(
+            {"_id": job_id, "status": {"$in": list(ACTIVE_STATUSES)}},
+            {"$set": {"cancel_requested": True}},
+        )
+        task = self.tasks.get(job_id)
+        if task:
+            task.cancel()
+        return res.matched_count > 0
+
+    async def resume_orphans(self) -> int:
+        """
+        Claim unfinished jobs whose owner stopped heartbeating
+        (process restart / crash) and run them from their checkpoint.
+        """
+        stale_before = now_utc() - timedelta(seconds=JOB_STALE_S)
+        resumed = 0
+
+        while True:
+            doc = await self.coll.find_one_and_update(
+                {
+                    "status": {"$in": list(ACTIVE_STATUSES)},
+                    "cancel_requested": {"$ne": True},
+                    "kind": {"$in": list(self.handlers)},
+                    "$or": [
+                        {"owner": {"$ne": INSTANCE_ID}, "heartbeat_at": {"$lte": stale_before}},
+                        {"heartbeat_at": {"$exists": False}},
+                    ],
+                },
+                {"$set": {"owner": INSTANCE_ID, "heartbeat_at": now_utc()}, "$inc": {"resumes": 1}},
+            )
+            if not doc:
+                return resumed
+            if doc["_id"] not in self.tasks:
+                self._start(doc["_id"])
+                resumed += 1
+
+    def start(self):
+        """Start the orphan sweep (first pass right away, then every JOB_SWEEP_S)."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        # Periodic, not just at startup: a process restarted within
+        # JOB_STALE_S of a crash still picks up the crashed jobs later
+        while True:
+            try:
+                resumed = await self.resume_orphans()
+                if resumed:
+                    print("Resumed jobs:", resumed)
+            except Exception as e:
+                print("Job resume ERROR:", e)
+            await asyncio.sleep(JOB_SWEEP_S)
+
+    async def shutdown(self):
+        """
+        Stop local tasks without marking them cancelled and release them
+        (drop heartbeat) so the next process resumes them right away.
+        """
+        self._stopping = True
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        job_ids = list(self.tasks)
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if job_ids:
+            await self.coll.update_many(
+                {"_id": {"$in": job_ids}, "status": {"$in": list(ACTIVE_STATUSES)}},
+                {"$unset": {"heartbeat_at": ""}},
+            )
+
+    async def status(self, job_id: str) -> Optional[dict]:
+        doc = await self.coll.find_one({"_id": job_id})
+        if not doc:
+            return None
+        return describe_job(doc)
+
+def describe_job(doc: dict) -> dict:
+    """Public view of a job doc, with an ETA for the current stage."""
+    progress = doc.get("progress") or {}
+    eta = None
+    done, total = progress.get("stage_done"), progress.get("stage_total")
+    started = progress.get("stage_started_at")
+    if doc.get("status") == "running" and done and total and started:
+        rate = done / max(time.time() - started, 1e-6)
+        eta = round(max(total - done, 0) / rate, 1) if rate > 0 else None
+
+    return {
+        "job_id": doc["_id"],
+        "kind": doc.get("kind"),
+        "status": doc.get("status"),
+        "stage": doc.get("stage"),
+        "params": doc.get("params"),
+        "progress": progress,
+        "eta_seconds": eta,
+        "result": doc.get("result"),
+        "error": doc.get("error"),
+        "resumes": doc.get("resumes", 0),
+        "created_at": doc.get("created_at"),
+        "started_at": doc.get("started_at"),
+        "finished_at": doc.get("finished_at"),
+    }
@@ -1,16 +1,67 @@
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
-import asyncio, os, re, random
+from pymongo import UpdateOne
+import asyncio, os, json, math, time, heapq, itertools
 # Internal imports
-from models import AmazonScrapeReq, ExtensionFullProduct
-from services import amazon_search_page, provider_google_shopping, provider_google_search
-from utils import now_utc, parse_price, _score_offers_for_extension
+from models import AmazonScrapeReq, ExtensionFullProduct, ExtensionBatchReq
+from services import amazon_search_page, provider_google_shopping, provider_google_search, serp_flight
+from utils import (
+    now_utc, parse_price, run_workers, deal_savings, image_flight, phash_flight, compute_phashes,
+    _score_offers_for_extension, _score_offers_batch, text_similarity_matrix,
+    DEAL_MIN_SAVINGS_ABS, DEAL_MIN_SAVINGS_PCT, TEXT_SIM_CUTOFF,
+)
+from http_client import start_http_client, close_http_client
+from imaging import start_image_pool, shutdown_image_pool
+from cache import serp_cache, phash_cache, resolve_cache, resolve_cache_key
+from singleflight import SingleFlight
+from ratelimit import serp_limiter
+from titles import analyze_title, title_cache_stats
+from catalog import offer_catalog, OFFER_CATALOG_MIN_DEALS
+from prices import price_recorder
+from metrics import registry, gauge_func, MetricsMiddleware, MongoCommandMetrics
+from topdeals import TopDeals, TOP_DEALS_K
+from refresh import (
+    due_filter, next_check_at, next_miss_retry_at, price_volatility, refresh_priority,
+)
+from jobs import JobRunner, JobContext, describe_job
+from store import (
+    BulkWriter, BULK_BATCH_SIZE, existing_keys, amazon_collection, match_collection,
+    existing_collection, collections_with_prefix, index_report, index_usage, backfill_savings,
+    DEALS_SORT, encode_deals_cursor, after_cursor_filter,
+    encode_multi_cursor, decode_multi_cursor, multi_after_filter,
+)
 
 # App + Environment Setup
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
-app = FastAPI(title="Amazon Deals")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    App-lifetime resources:
+    - Shared pooled HTTP client (SerpAPI + image downloads)
+    - Image decode/pHash worker pool
+    - Background job runner (periodically resumes orphaned jobs)
+    - Local offer catalog (reloaded from Mongo)
+    """
+    await start_http_client()
+    start_image_pool()
+    try:
+        print("Offer catalog loaded:", await offer_catalog.load())
+    except Exception as e:
+        print("Offer catalog load ERROR:", e)
+    job_runner.start()
+    try:
+        yield
+    finally:
+        await job_runner.shutdown()
+        await close_http_client()
+        shutdown_image_pool()
+
+app = FastAPI(title="Amazon Deals", lifespan=lifespan)
 # Allow frontend to communicate freely (Chrome extension + dashboard)
 app.add_middleware(
     CORSMiddleware,
@@ -21,14 +72,65 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Request latency per route + Mongo attribution (/metrics)
+app.add_middleware(MetricsMiddleware)
+
 # MongoDB Setup
 MONGO_URL = os.getenv("MONGO_URL")
 MONGO_DB = os.getenv("MONGO_DB", "MongoDB")
 if not MONGO_URL:
     raise RuntimeError("MONGO_URL env var is required")
-client = AsyncIOMotorClient(MONGO_URL)
+# Command listener counts Mongo round trips per endpoint for /metrics
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[MongoCommandMetrics()])
 db = client[MONGO_DB]
 
+# Optional Mongo tier for the SerpAPI response cache (shared across workers)
+SERP_CACHE_COLL = os.getenv("SERP_CACHE_COLL")
+if SERP_CACHE_COLL:
+    serp_cache.attach_mongo(db[SERP_CACHE_COLL])
+
+# Persistent URL -> pHash cache (set PHASH_CACHE_COLL="" to keep it in memory only)
+PHASH_CACHE_COLL = os.getenv("PHASH_CACHE_COLL", "phash_cache")
+if PHASH_CACHE_COLL:
+    phash_cache.attach_mongo(db[PHASH_CACHE_COLL])
+
+# Persistent merchant URL resolutions (set RESOLVE_CACHE_COLL="" to keep them in memory only)
+RESOLVE_CACHE_COLL = os.getenv("RESOLVE_CACHE_COLL", "resolve_cache")
+if RESOLVE_CACHE_COLL:
+    resolve_cache.attach_mongo(db[RESOLVE_CACHE_COLL])
+
+# Local offer catalog (set OFFER_CATALOG_COLL="" to keep it in memory only)
+OFFER_CATALOG_COLL = os.getenv("OFFER_CATALOG_COLL", "offer_catalog")
+if OFFER_CATALOG_COLL:
+    offer_catalog.attach_mongo(db[OFFER_CATALOG_COLL])
+
+# Append-only price observations (set PRICE_HISTORY_COLL="" to disable)
+PRICE_HISTORY_COLL = os.getenv("PRICE_HISTORY_COLL", "price_history")
+if PRICE_HISTORY_COLL:
+    price_recorder.attach_mongo(db[PRICE_HISTORY_COLL])
+
+# Materialized top-K deals per match collection (dashboard fast path)
+TOP_DEALS_COLL = os.getenv("TOP_DEALS_COLL", "top_deals")
+top_deals = TopDeals(db[TOP_DEALS_COLL])
+
+# Background jobs (full ingest); unfinished jobs resume at startup
+JOBS_COLL = os.getenv("JOBS_COLL", "jobs")
+job_runner = JobRunner(db[JOBS_COLL])
+
+# Amazon product fields needed for matching
+AMZ_ITEM_PROJECTION = {
+    "_id": 0,
+    "asin": 1,
+    "title": 1,
+    "brand": 1,
+    "price": 1,
+    "thumbnail": 1,
+    "image_url": 1,
+}
+
+# Concurrent SAVE presses for the same product share one lookup
+resolve_flight = SingleFlight("resolve")
+
 # Chrome Extension: Find Deals (core deal-finding logic)
 @app.post("/extension/find-deals")
 async def extension_find_deals(payload: ExtensionFullProduct):
@@ -38,9 +140,11 @@ async def extension_find_deals(payload: ExtensionFullProduct):
 
     Flow:
     1. Build a Google Shopping query ("brand title")
-    2. Fetch Google Shopping results
-    3. Run our full scoring engine (text similarity, image similarity, units)
-    4. Return best 5 deals
+    2. Try offers from the local catalog (fresh, similar titles);
+       done if they already give a deal
+    3. Otherwise fetch Google Shopping results
+    4. Run our full scoring engine (text similarity, image similarity, units)
+    5. Return best 5 deals
     """
 
     if not SERPAPI_KEY:
@@ -51,6 +155,10 @@ async def extension_find_deals(payload: ExtensionFullProduct):
 
     query = f"{payload.brand} {payload.title}" if payload.brand else payload.title
 
+    local = await _local_deals([payload], query)
+    if local:
+        return local[0]
+
     # Fetch Google Shopping offers
     try:
         gshop_offers = await provider_google_shopping(query)
@@ -60,6 +168,108 @@ async def extension_find_deals(payload: ExtensionFullProduct):
 
     return await _score_offers_for_extension(payload, gshop_offers)
 
+async def _local_deals(payloads: List[ExtensionFullProduct], query: str) -> Optional[List[dict]]:
+    """
+    Score `payloads` against catalog offers for `query`. Returns None
+    (caller goes to SerpAPI) unless every product gets enough deals.
+
+    Text similarity is checked first: if some product cannot reach
+    OFFER_CATALOG_MIN_DEALS text matches, it is a miss before any
+    image is downloaded.
+    """
+    offers = offer_catalog.lookup(query)
+    if offers:
+        matrix = text_similarity_matrix([p.title for p in payloads], [o["title"] for o in offers])
+        if all(int((row >= TEXT_SIM_CUTOFF).sum()) >= OFFER_CATALOG_MIN_DEALS for row in matrix):
+            results = await _score_offers_batch(payloads, offers, matrix=matrix)
+            if all(len(r.get("best_deals") or []) >= OFFER_CATALOG_MIN_DEALS for r in results):
+                offer_catalog.hits += 1
+                return results
+
+    offer_catalog.misses += 1
+    return None
+
+# Chrome Extension: many products per call (search results pages)
+# Unique Google Shopping queries looked up at once (SerpAPI pacing is the shared limiter)
+EXTENSION_BATCH_CONCURRENCY = int(os.getenv("EXTENSION_BATCH_CONCURRENCY", "8"))
+
+def _extension_query(p: ExtensionFullProduct) -> str:
+    return f"{p.brand} {p.title}" if p.brand else p.title
+
+@app.post("/extension/find-deals/batch")
+async def extension_find_deals_batch(req: ExtensionBatchReq):
+    """
+    Same result as /extension/find-deals, for up to 50 products in one call.
+
+    - Products sharing a Google Shopping query share one local catalog
+      lookup / SerpAPI lookup and one text-similarity matrix
+    - Unique queries are fetched concurrently (shared rate limiter)
+    - Amazon thumbnails are hashed while the lookups are in flight;
+      offer images are shared through the pHash cache / coalescing
+    - Streams NDJSON, one line per product as soon as it is scored:
+      {"index": i, ...find-deals result} or {"index": i, "error": ...}
+    """
+
+    if not SERPAPI_KEY:
+        raise HTTPException(500, "SERPAPI_KEY not set")
+
+    groups: dict = {}
+    invalid = []
+    for i, p in enumerate(req.products):
+        if not p.title or not p.price:
+            invalid.append(i)
+            continue
+        groups.setdefault(_extension_query(p), []).append(i)
+
+    sem = asyncio.Semaphore(max(1, EXTENSION_BATCH_CONCURRENCY))
+
+    async def score_group(query: str, indexes: List[int]):
+        try:
+            local = await _local_deals([req.products[i] for i in indexes], query)
+        except Exception as e:
+            print("Local deals ERROR:", e)
+            local = None
+        if local:
+            return indexes, local
+
+        async with sem:
+            try:
+                offers = await provider_google_shopping(query)
+            except Exception as e:
+                print("Google Shopping ERROR:", e)
+                offers = []
+        try:
+            results = await _score_offers_batch([req.products[i] for i in indexes], offers)
+        except Exception as e:
+            print("Batch scoring ERROR:", e)
+            results = [{"error": "Scoring failed"} for _ in indexes]
+        return indexes, results
+
+    async def lines():
+        for i in invalid:
+            yield json.dumps({"index": i, "error": "Missing title or price"}) + "\n"
+
+        # Warm the pHash cache with Amazon thumbnails (deduped) in the background
+        amazon_urls = list({
+            req.products[i].thumbnail or req.products[i].image_url
+            for indexes in groups.values() for i in indexes
+        } - {None})
+        warm = asyncio.ensure_future(compute_phashes(amazon_urls))
+
+        tasks = [asyncio.ensure_future(score_group(q, idx)) for q, idx in groups.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indexes, results = await next_done
+                for i, result in zip(indexes, results):
+                    yield json.dumps({"index": i, **result}, default=str) + "\n"
+        finally:
+            # Client went away: stop the remaining lookups
+            for task in tasks + [warm]:
+                task.cancel()
+            await asyncio.gather(*tasks, warm, return_exceptions=True)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 # Chrome Extension: Resolve merchant URL (used when saving a product)
 @app.post("/extension/resolve-merchant-url")
 async def resolve_merchant_url(data: dict):
@@ -75,9 +285,12 @@ async def resolve_merchant_url(data: dict):
     }
 
     Strategy:
-    - Make a Google Search query: "<domain> <title>"
+    - Answer from the resolution cache (normalized domain + title,
+      ~10% price band); unresolved links are cached for a shorter time
+    - Otherwise make a Google Search query: "<domain> <title>"
     - Look through shopping_results first (price-aware)
     - If no strong match, look in organic_results
+    - Identical concurrent requests share one lookup
     """
 
     source_domain = data.get("source_domain")
@@ -86,18 +299,254 @@ async def resolve_merchant_url(data: dict):
     if not source_domain or not title:
         raise HTTPException(400, "source_domain and title required")
 
-    expected_price = data.get("expected_price")
-    query = f"{source_domain} {title}"
+    url = await _resolve_cached(source_domain, title, data.get("expected_price"))
+    return {"resolved_url": url}
+
+async def _resolve_cached(source_domain: str, title: str, expected_price=None) -> Optional[str]:
+    key = resolve_cache_key(source_domain, title, expected_price)
+    found, url = await resolve_cache.get(key)
+    if found:
+        return url
+    return await resolve_flight.do(key, _resolve_and_store, key, source_domain, title, expected_price)
 
+async def _resolve_and_store(key: str, source_domain: str, title: str, expected_price=None) -> Optional[str]:
+    # Errors propagate uncached, only "no match" is a negative entry
     url = await provider_google_search(
-        query,
+        f"{source_domain} {title}",
         expected_title=title,
         expected_price=expected_price,
     )
+    await resolve_cache.set(key, url)
+    return url
 
-    return {"resolved_url": url}
+# Warm path: pre-resolve every offer shown on the deals dashboard
+async def _resolve_warm_job(job: JobContext) -> dict:
+    """
+    Job handler: resolve (domain, title, price) of every best_deals offer
+    in match_coll, best deals first. Already-cached pairs are skipped,
+    which also makes a resumed job pick up where it stopped.
+    """
+    p = job.params
+    MATCH = await existing_collection(db, p["match_coll"])
+    if MATCH is None:
+        # Never create a collection from a request param (dropped since submit)
+        return {"offers": 0, "already_cached": 0, "resolved": 0, "unresolved": 0, "errors": 0}
+    limit = p.get("limit", 1000)
+
+    docs = await MATCH.find({"match_found": True}, {"_id": 0, "best_deals": 1}) \
+        .sort(DEALS_SORT).limit(limit).to_list(limit)
+
+    pairs = {}
+    for doc in docs:
+        for o in doc.get("best_deals") or []:
+            if o.get("source_domain") and o.get("title"):
+                key = resolve_cache_key(o["source_domain"], o["title"], o.get("price"))
+                pairs.setdefault(key, o)
+
+    todo = []
+    for key, o in pairs.items():
+        found, _ = await resolve_cache.get(key)
+        if not found:
+            todo.append((key, o))
+
+    await job.set_stage("resolve", total=len(todo))
+    stats = {"resolved": 0, "unresolved": 0, "errors": 0}
+
+    async def resolve_one(pair):
+        key, o = pair
+        try:
+            url = await resolve_flight.do(
+                key, _resolve_and_store, key, o["source_domain"], o["title"], o.get("price")
+            )
+            stats["resolved" if url else "unresolved"] += 1
+        except Exception as e:
+            print("Resolve warm ERROR:", e)
+            stats["errors"] += 1
+            job.incr("errors")
+        job.incr("stage_done")
+        await job.save()
+
+    await run_workers(todo, resolve_one, p.get("concurrency", 4))
+
+    return {"offers": len(pairs), "already_cached": len(pairs) - len(todo), **stats}
+
+job_runner.register("resolve_warm", _resolve_warm_job)
+
+@app.post("/extension/resolve-merchant-url/warm", status_code=202)
+async def resolve_merchant_url_warm(
+    match_coll: str = Query(...),
+    limit: int = Query(1000, ge=1, le=10000),
+    concurrency: int = Query(4, ge=1, le=32),
+):
+    """
+    Background job that pre-resolves merchant URLs for the offers of the
+    top `limit` deals in `match_coll`, so SAVE on dashboard deals is a
+    cache hit. Track it with GET /jobs/{job_id}.
+    """
+    if not SERPAPI_KEY:
+        raise HTTPException(500, "SERPAPI_KEY not set")
+    if await existing_collection(db, match_coll) is None:
+        raise HTTPException(404, "Unknown match_coll")
+
+    job_id = await job_runner.submit("resolve_warm", {
+        "match_coll": match_coll,
+        "limit": limit,
+        "concurrency": concurrency,
+    })
+    return {"job_id": job_id, "status": "queued"}
 
 # Amazon Scraping (SERP to get Amazon organic results)
+def _amazon_doc(it: dict) -> Optional[dict]:
+    """
+    Turn one Amazon organic result into our product doc.
+    Returns None for incomplete items and multipacks/bundles/bulk sizes.
+    """
+    asin = it.get("asin")
+    title = it.get("title")
+    price = parse_price(it.get("price"))
+    brand = it.get("brand")
+    link = it.get("link") or it.get("product_link")
+    thumbnail = it.get("thumbnail") or it.get("image")
+
+    if not asin or not title or not price:
+        return None
+
+    # Skip multipacks/bulk, quality control
+    if analyze_title(title).multipack:
+        return None
+
+    return {
+        "asin": asin,
+        "title": title,
+        "brand": brand,
+        "price": price,
+        "thumbnail": thumbnail,
+        "image_url": thumbnail,
+        "link": link,
+        "updatedAt": now_utc(),
+    }
+
+# Pages are fetched in concurrent waves; pacing comes from the shared SerpAPI limiter
+SCRAPE_PAGE_CONCURRENCY = int(os.getenv("SCRAPE_PAGE_CONCURRENCY", "10"))
+# Accepted items per page assumed until the first page is in (sizes the first wave)
+SCRAPE_PAGE_EXPECTED_ITEMS = int(os.getenv("SCRAPE_PAGE_EXPECTED_ITEMS", "16"))
+
+async def _fetch_amazon_page(query: str, pg: int) -> List[dict]:
+    """One results page (serp_get already retries 429s, timeouts and network errors)."""
+    data = await amazon_search_page(query, page=pg)
+    return data.get("organic_results") or []
+
+def _wave_size(needed: int, per_page: float, pages_left: int) -> int:
+    """Pages to request next: enough for `needed` items at `per_page`, within limits."""
+    return max(1, min(SCRAPE_PAGE_CONCURRENCY, pages_left, math.ceil(needed / max(per_page, 1.0))))
+
+async def _scrape_category(
+    query: str,
+    pages: int,
+    max_products: int,
+    amz_coll: str,
+    job: Optional[JobContext] = None,
+    sink: Optional[Callable[[List[dict]], Awaitable[None]]] = None,
+) -> dict:
+    """
+    Scrape stage shared by /amazon/scrape-category and full-ingest jobs.
+
+    Pages are requested in waves of up to SCRAPE_PAGE_CONCURRENCY, sized by
+    how many items are still missing (at the accepted-items-per-page rate
+    seen so far), and merged in page order. `max_products` is checked
+    between waves, so an early stop saves the SerpAPI calls of later pages.
+
+    With a `job`, every finished page is flushed and checkpointed
+    (pages_done + accepted count) so a resumed job skips it.
+    `sink` (optional) is awaited with each page's accepted docs, so a
+    downstream stage can start on them right away.
+    """
+    AMZ = await amazon_collection(db, amz_coll)
+    writer = BulkWriter(AMZ)
+
+    checkpoint = job.checkpoint if job else {}
+    pages_done = set(checkpoint.get("pages_done") or [])
+    total = checkpoint.get("scraped", 0)
+    pages_fetched = 0
+    page_errors = 0
+
+    todo = [pg for pg in range(1, pages + 1) if pg not in pages_done]
+    accepted_here = 0
+    fetches = {}
+
+    try:
+        while todo and total < max_products:
+            per_page = accepted_here / pages_fetched if pages_fetched else SCRAPE_PAGE_EXPECTED_ITEMS
+            n = _wave_size(max_products - total, per_page, len(todo))
+            wave, todo = todo[:n], todo[n:]
+            fetches = {pg: asyncio.ensure_future(_fetch_amazon_page(query, pg)) for pg in wave}
+
+            # Merge in page order (page 1 is processed while later pages still load)
+            for pg, fetch in fetches.items():
+                if total >= max_products:
+                    break
+
+                try:
+                    items = await fetch
+                    pages_fetched += 1
+                except Exception as e:
+                    print("SERPAPI ERROR during amazon_search_page:", e)
+                    page_errors += 1
+                    if job:
+                        job.incr("errors")
+                        await job.save()
+                    continue
+
+                accepted = []
+                for it in items:
+                    if total >= max_products:
+                        break
+
+                    doc = _amazon_doc(it)
+                    if not doc:
+                        continue
+
+                    # Upsert Amazon product (buffered)
+                    await writer.add(UpdateOne(
+                        {"asin": doc["asin"]},
+                        {"$set": doc, "$setOnInsert": {"createdAt": now_utc()}},
+                        upsert=True,
+                    ))
+
+                    total += 1
+                    accepted_here += 1
+                    accepted.append(doc)
+                    await price_recorder.add(doc["asin"], "amazon", doc["price"])
+
+                if sink and accepted:
+                    await sink(accepted)
+
+                if job:
+                    # Page is durable before it is checkpointed
+                    await writer.flush()
+                    pages_done.add(pg)
+                    checkpoint["pages_done"] = sorted(pages_done)
+                    checkpoint["scraped"] = total
+                    job.progress["items_scraped"] = total
+                    job.incr("pages_scraped")
+                    await job.save(force=True)
+    finally:
+        # Early stop / error: drop page requests nobody will read
+        for fetch in fetches.values():
+            fetch.cancel()
+        await asyncio.gather(*fetches.values(), return_exceptions=True)
+        # Buffered upserts are written even when scraping failed midway
+        await writer.flush()
+        await price_recorder.flush()
+
+    return {
+        "query": query,
+        "pages_requested": pages,
+        "pages_fetched": pages_fetched,
+        "page_errors": page_errors,
+        "total": total,
+    }
+
 @app.post("/amazon/scrape-category")
 async def amazon_scrape_category(req: AmazonScrapeReq, amz_coll: Optional[str] = Query(None)):
     """
@@ -105,299 +554,752 @@ async def amazon_scrape_category(req: AmazonScrapeReq, amz_coll: Optional[str] =
 
     Notes:
     - Skips multipacks, bundles, bulk sizes
-    - Inserts/updates into `amz_coll`
+    - Inserts/updates into `amz_coll` (buffered, unordered bulk writes)
     - Does NOT return deals — just builds our Amazon product database
     """
 
     if not SERPAPI_KEY:
         raise HTTPException(500, "SERPAPI_KEY not set")
 
-    AMZ = db[amz_coll]
-    total = 0
-    pages_fetched = 0
-    page_errors = 0
+    return await _scrape_category(req.query, req.pages, req.max_products, amz_coll)
 
-    for pg in range(1, req.pages + 1):
-        if total >= req.max_products:
-            break
+# Google Shopping Indexing (where the real deal matching happens)
+def _match_writer(match_coll: str, MATCH, batch_size: int = BULK_BATCH_SIZE) -> BulkWriter:
+    """Buffered match writes; each flushed batch is folded into the top-K deals doc."""
+    async def update_top_deals(docs):
+        await top_deals.apply(match_coll, MATCH, docs)
 
-        try:
-            data = await amazon_search_page(req.query, page=pg)
-            items = data.get("organic_results") or []
-            pages_fetched += 1
-        except Exception as e:
-            print("SERPAPI ERROR during amazon_search_page:", e)
-            page_errors += 1
-            await asyncio.sleep(1.0 + random.random())
-            continue
+    return BulkWriter(MATCH, batch_size=batch_size, after_flush=update_top_deals)
 
-        for it in items:
-            if total >= req.max_products:
-                break
+async def _index_item(item: dict, writer: BulkWriter, stats: dict, prev: Optional[dict] = None):
+    """
+    Match ONE Amazon product against Google Shopping and buffer its match doc.
 
-            asin = it.get("asin")
-            title = it.get("title")
-            price = parse_price(it.get("price"))
-            brand = it.get("brand")
-            link = it.get("link") or it.get("product_link")
-            thumbnail = it.get("thumbnail") or it.get("image")
+    `prev` is the existing match doc (refresh mode); it feeds the
+    volatility estimate and the miss backoff counter. Refreshes skip the
+    SERP response cache, which outlives the shortest refresh TTL and would
+    hand back the prices being refreshed.
+    """
+    asin = item["asin"]
 
-            if not asin or not title or not price:
-                continue
+    brand = item.get("brand") or ""
+    title = item.get("title") or ""
+    query = f"{brand} {title}".strip()
+    now = now_utc()
 
-            # Skip multipacks/bulk, quality control
-            t = title.lower()
+    # Pull Google Shopping offers
+    try:
+        offers = await provider_google_shopping(query, bypass_cache=prev is not None)
+    except Exception as e:
+        print("Google Shopping ERROR:", e)
 
-            if "pack of" in t:
-                continue
+        miss_count = ((prev or {}).get("miss_count") or 0) + 1
+        await writer.add(UpdateOne(
+            {"key_val": asin},
+            {
+                "$set": {
+                    "key_type": "asin",
+                    "key_val": asin,
+                    "checked_at": now,
+                    "miss": True,
+                    "miss_count": miss_count,
+                    "next_check_at": next_miss_retry_at(now, miss_count),
+                }
+            },
+            upsert=True
+        ))
+
+        stats["misses"] += 1
+        return
+
+    # Score offers using the extension's logic
+    payload = ExtensionFullProduct(
+        asin=asin,
+        title=title,
+        price=float(item["price"]),
+        brand=item.get("brand"),
+        thumbnail=item.get("thumbnail"),
+        image_url=item.get("image_url"),
+    )
 
-            if re.search(r"\b\d+\s*(pack|packet|bundle|variety|ct|count)\b", t):
-                continue
+    scored = await _score_offers_for_extension(payload, offers)
+    best_deals = scored.get("best_deals") or []
+    top_match = best_deals[0] if best_deals else None
+    savings_abs, savings_pct = deal_savings(item.get("price"), best_deals)
+    volatility = price_volatility(prev, top_match["price"] if top_match else None)
+
+    # Save match info (savings precomputed for /deals/google)
+    doc = {
+        "key_type": "asin",
+        "key_val": asin,
+        "checked_at": now,
+        "match_found": len(best_deals) > 0,
+        "amazon": {
+            "asin": asin,
+            "title": item.get("title"),
+            "price": item.get("price"),
+            "brand": item.get("brand"),
+            "thumbnail": item.get("thumbnail"),
+            "image_url": item.get("image_url"),
+        },
+        "best_match": top_match,
+        "best_deals": best_deals,
+        "offers": best_deals,    # Used by frontend dashboard
+        "savings_abs": savings_abs,
+        "savings_pct": savings_pct,
+        # Refresh scheduling
+        "miss": False,
+        "miss_count": 0,
+        "volatility": volatility,
+        "refresh_priority": refresh_priority(savings_abs, volatility),
+        "next_check_at": next_check_at(now, bool(best_deals), savings_pct, volatility),
+    }
 
-            if re.search(r"\b\d+\s*pk\b", t):
-                continue
+    await writer.add(UpdateOne(
+        {"key_val": asin},
+        {"$set": doc},
+        upsert=True
+    ), doc=doc)
+
+    # Best offer price trajectory (only moves are stored)
+    if top_match:
+        await price_recorder.add(asin, "offer", top_match.get("price"), now)
+
+    stats["processed"] += 1
+
+async def _index_tracked(item: dict, writer: BulkWriter, stats: dict, job: Optional[JobContext] = None):
+    """_index_item + job progress (stage_done, items_indexed, errors)."""
+    misses_before = stats["misses"]
+    await _index_item(item, writer, stats)
+
+    if job:
+        job.incr("stage_done")
+        job.incr("items_indexed")
+        if stats["misses"] > misses_before:
+            job.incr("errors")
+        await job.save()
+
+async def _index_category(
+    amz_coll: str,
+    match_coll: str,
+    limit_items: int = 300,
+    concurrency: int = 4,
+    per_call_delay_ms: int = 0,
+    job: Optional[JobContext] = None,
+) -> dict:
+    """
+    Index stage shared by /google-shopping/index-by-title and full-ingest jobs.
 
-            if re.search(r"\b\d+\s*x\s*\d+", t):
-                continue
+    Naturally resumable: ASINs whose match doc was already flushed are skipped.
+    """
+    AMZ = await amazon_collection(db, amz_coll)
+    MATCH = await match_collection(db, match_coll)
 
-            doc = {
-                "asin": asin,
-                "title": title,
-                "brand": brand,
-                "price": price,
-                "thumbnail": thumbnail,
-                "image_url": thumbnail,
-                "link": link,
-                "updatedAt": now_utc(),
-            }
-
-            # Upsert Amazon product
-            await AMZ.update_one(
-                {"asin": asin},
-                {"$set": doc, "$setOnInsert": {"createdAt": now_utc()}},
-                upsert=True,
-            )
+    # Fetch Amazon items
+    amz_items = await AMZ.find({}, AMZ_ITEM_PROJECTION).limit(limit_items).to_list(length=limit_items)
 
-            total += 1
+    # Skip items already indexed once (single round trip)
+    indexed = await existing_keys(MATCH, "key_val", (it.get("asin") for it in amz_items))
+    todo = [it for it in amz_items if it.get("asin") and it["asin"] not in indexed]
 
-        await asyncio.sleep(0.4 + random.random() * 0.3)
+    writer = _match_writer(match_coll, MATCH)
+    stats = {"processed": 0, "misses": 0}
+
+    if job:
+        await job.set_stage("index", total=len(todo))
+
+    async def index_one(item: dict):
+        await _index_tracked(item, writer, stats, job)
+
+        if per_call_delay_ms:
+            await asyncio.sleep(per_call_delay_ms / 1000.0)
+
+    try:
+        await run_workers(todo, index_one, concurrency)
+    finally:
+        await writer.flush()
+        await price_recorder.flush()
 
     return {
-        "query": req.query,
-        "pages_requested": req.pages,
-        "pages_fetched": pages_fetched,
-        "page_errors": page_errors,
-        "total": total,
+        "processed": stats["processed"],
+        "misses": stats["misses"],
+        "total_in_amazon_collection": len(amz_items),
     }
 
-# Google Shopping Indexing (where the real deal matching happens)
 @app.post("/google-shopping/index-by-title")
 async def google_index_by_title(
     amz_coll: str = Query(...),
     match_coll: str = Query(...),
     limit_items: int = 300,
-    per_call_delay_ms: int = 400
+    concurrency: int = Query(4, ge=1, le=32),
+    per_call_delay_ms: int = 0
 ):
     """
     This builds the MATCH collection.
     Flow:
-    - Iterate through Amazon products
+    - Iterate through Amazon products (`concurrency` workers in parallel)
     - Query Google Shopping using "<merchant> <title>"
     - Score all offers using the SAME pipeline as the Chrome extension
-    - Store top 5 offers + best_match in match_coll
+    - Store top 5 offers + best_match in match_coll (buffered bulk writes)
+
+    Already-indexed ASINs are found with one $in query up front and
+    skipped; /google-shopping/refresh keeps them fresh.
+    Throughput is governed by the shared SerpAPI rate limiter
+    (SERP_RATE_PER_SEC / SERP_RATE_BURST), which also backs off on 429.
+    `per_call_delay_ms` is kept for old callers as an optional per-worker pause.
     """
     if not SERPAPI_KEY:
         raise HTTPException(500, "SERPAPI_KEY not set")
 
-    AMZ = db[amz_coll]
-    MATCH = db[match_coll]
-
-    # Fetch Amazon items
-    amz_items = await AMZ.find(
-        {},
-        {
-            "_id": 0,
-            "asin": 1,
-            "title": 1,
-            "brand": 1,
-            "price": 1,
-            "thumbnail": 1,
-            "image_url": 1,
-        }
-    ).limit(limit_items).to_list(length=limit_items)
-
-    processed = 0
-    misses = 0
+    return await _index_category(amz_coll, match_coll, limit_items, concurrency, per_call_delay_ms)
 
-    for item in amz_items:
-        asin = item.get("asin")
-        if not asin:
-            continue
+# Incremental Refresh (re-index only stale items)
+@app.post("/google-shopping/refresh")
+async def google_refresh(
+    amz_coll: str = Query(...),
+    match_coll: str = Query(...),
+    limit_items: int = 100,
+    concurrency: int = Query(4, ge=1, le=32),
+):
+    """
+    Re-index only the delta that went stale.
 
-        # Skip items already indexed once
-        cached = await MATCH.find_one({"key_val": asin})
-        if cached:
-            continue
+    - Selects match docs whose `next_check_at` has passed
+      (per-item TTL: shorter for big / volatile deals)
+    - Previous misses come back on exponential backoff
+    - Highest `refresh_priority` (savings x volatility) first
+    - Uses the latest Amazon data from amz_coll when available
+    """
+    if not SERPAPI_KEY:
+        raise HTTPException(500, "SERPAPI_KEY not set")
 
-        brand = item.get("brand") or ""
-        title = item.get("title") or ""
-        query = f"{brand} {title}".strip()
+    AMZ = await amazon_collection(db, amz_coll)
+    MATCH = await match_collection(db, match_coll)
 
-        # Pull Google Shopping offers
-        try:
-            offers = await provider_google_shopping(query)
-        except Exception as e:
-            print("Google Shopping ERROR:", e)
-
-            await MATCH.update_one(
-                {"key_val": asin},
-                {
-                    "$set": {
-                        "key_type": "asin",
-                        "key_val": asin,
-                        "checked_at": now_utc(),
-                        "miss": True,
-                    }
-                },
-                upsert=True
-            )
-
-            misses += 1
-            continue
+    due = await MATCH.find(
+        due_filter(now_utc()),
+        {
+            "_id": 0,
+            "key_val": 1,
+            "amazon": 1,
+            "best_match": 1,
+            "miss_count": 1,
+            "volatility": 1,
+            "refresh_priority": 1,
+        },
+    ).sort([("refresh_priority", -1)]).limit(limit_items).to_list(limit_items)
+
+    # Current Amazon product data (one $in query)
+    asins = [d["key_val"] for d in due if d.get("key_val")]
+    fresh = {
+        it["asin"]: it
+        async for it in AMZ.find({"asin": {"$in": asins}}, AMZ_ITEM_PROJECTION)
+    }
 
-        # Score offers using the extension's logic
-        payload = ExtensionFullProduct(
-            asin=asin,
-            title=title,
-            price=float(item["price"]),
-            brand=item.get("brand"),
-            thumbnail=item.get("thumbnail"),
-            image_url=item.get("image_url"),
-        )
+    jobs = []
+    for prev in due:
+        item = fresh.get(prev.get("key_val")) or prev.get("amazon")
+        if item and item.get("asin") and item.get("price") is not None:
+            jobs.append((item, prev))
 
-        scored = await _score_offers_for_extension(payload, offers)
-        best_deals = scored.get("best_deals") or []
-        top_match = best_deals[0] if best_deals else None
-
-        # Save match info
-        doc = {
-            "key_type": "asin",
-            "key_val": asin,
-            "checked_at": now_utc(),
-            "match_found": len(best_deals) > 0,
-            "amazon": {
-                "asin": asin,
-                "title": item.get("title"),
-                "price": item.get("price"),
-                "brand": item.get("brand"),
-                "thumbnail": item.get("thumbnail"),
-                "image_url": item.get("image_url"),
-            },
-            "best_match": top_match,
-            "best_deals": best_deals,
-            "offers": best_deals,    # Used by frontend dashboard
-        }
+    writer = _match_writer(match_coll, MATCH)
+    stats = {"processed": 0, "misses": 0}
 
-        await MATCH.update_one(
-            {"key_val": asin},
-            {"$set": doc},
-            upsert=True
-        )
+    async def refresh_one(job):
+        item, prev = job
+        await _index_item(item, writer, stats, prev=prev)
 
-        processed += 1
-        await asyncio.sleep(per_call_delay_ms / 1000.0)
+    try:
+        await run_workers(jobs, refresh_one, concurrency)
+    finally:
+        await writer.flush()
+        await price_recorder.flush()
 
     return {
-        "processed": processed,
-        "misses": misses,
-        "total_in_amazon_collection": len(amz_items),
+        "due": len(due),
+        "refreshed": stats["processed"],
+        "misses": stats["misses"],
     }
 
 # Deals Endpoint (dashboard uses this)
+# Only what the dashboard renders (+ the keyset fields, stripped before returning)
+DEALS_PROJECTION = {"_id": 0, "amazon": 1, "offers": 1, "savings_abs": 1, "key_val": 1}
+
+def _deal_out(doc: dict) -> dict:
+    return {"amazon": doc.get("amazon"), "offers": doc.get("offers")}
+
 @app.get("/deals/google")
 async def deals_google(
     match_coll: Optional[str] = Query(None),
-    limit: int = 100
+    limit: int = Query(100, ge=1),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
 ):
     """
     Frontend dashboard calls this to load deals.
 
     It:
     - Reads the MATCH collection
-    - Applies final savings filters
-    - Sorts by strongest absolute savings
+    - Applies final savings filters (server-side, on precomputed savings)
+    - Sorts by strongest absolute savings, key_val as tie-breaker
+      (served by the match_savings index)
+    - Returns one page of `limit` deals, dashboard fields only
+
+    Paging: pass the returned `next_cursor` back as `cursor`.
+    First pages (limit < TOP_DEALS_K) come from the materialized
+    top-K document instead of querying the match collection.
+
+    format=ndjson streams one deal per line straight off the Mongo cursor,
+    followed by a final {"next_cursor": ..., "count": ...} line.
+
+    A `match_coll` that does not exist yet gives an empty page
+    (nothing is created for it).
     """
 
-    MATCH = db[match_coll]
+    try:
+        after = after_cursor_filter(cursor)
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+    MATCH = await existing_collection(db, match_coll)
+    if MATCH is None:
+        if format == "ndjson":
+            return StreamingResponse(
+                iter([json.dumps({"next_cursor": None, "count": 0}) + "\n"]),
+                media_type="application/x-ndjson",
+            )
+        return {"count": 0, "deals": [], "next_cursor": None}
 
-    matches = await MATCH.find(
-        {"match_found": True},
-        {"_id": 0},
-    ).to_list(limit * 5)
+    query = {
+        "match_found": True,
+        "savings_abs": {"$gte": DEAL_MIN_SAVINGS_ABS},
+        "savings_pct": {"$gte": DEAL_MIN_SAVINGS_PCT},
+        **after,
+    }
 
-    deals = []
+    # Fast path: first page straight from the materialized top-K.
+    # Needs limit < K: a truncated list holds K entries, so "more than
+    # limit" is what tells the client another page exists.
+    if format == "json" and not cursor and limit < TOP_DEALS_K:
+        top = await top_deals.read(match_coll, MATCH)
+        page = top[:limit]
+        next_cursor = None
+        if len(top) > limit:
+            next_cursor = encode_deals_cursor(page[-1]["savings_abs"], page[-1]["key_val"])
+        return {
+            "count": len(page),
+            "deals": [_deal_out(d) for d in page],
+            "next_cursor": next_cursor,
+        }
 
-    for m in matches:
-        amz = m.get("amazon")
-        offers = m.get("offers") or m.get("best_deals") or []
+    # One extra row tells us whether another page exists
+    mongo_cursor = MATCH.find(query, DEALS_PROJECTION).sort(DEALS_SORT).limit(limit + 1)
+
+    if format == "ndjson":
+        async def stream():
+            count = 0
+            last = None
+            async for doc in mongo_cursor:
+                if count == limit:
+                    # Extra row read, so there is a next page after `last`
+                    next_cursor = encode_deals_cursor(last["savings_abs"], last["key_val"])
+                    yield json.dumps({"next_cursor": next_cursor, "count": count}) + "\n"
+                    return
+                count += 1
+                last = doc
+                yield json.dumps(_deal_out(doc), default=str) + "\n"
+            yield json.dumps({"next_cursor": None, "count": count}) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    docs = await mongo_cursor.to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_deals_cursor(docs[-1]["savings_abs"], docs[-1]["key_val"])
 
-        if not amz or not offers:
-            continue
+    return {
+        "count": len(docs),
+        "deals": [_deal_out(d) for d in docs],
+        "next_cursor": next_cursor,
+    }
 
-        top = offers[0]
-        amz_price = float(amz["price"])
-        other_price = float(top["price"])
+# Deals across categories (every match_<slug> collection)
+MATCH_COLL_PREFIX = os.getenv("MATCH_COLL_PREFIX", "match_")
 
-        # Require meaningful savings
-        savings_abs = amz_price - other_price
-        if savings_abs < 2:
-            continue
+async def _category_deals(name: str, limit: int, position) -> List[dict]:
+    """
+    Up to `limit` deals of one existing collection after `position`, best
+    first, each tagged with its collection. First pages use the
+    materialized top-K.
+    """
+    MATCH = db[name]
+
+    if position is None and limit <= TOP_DEALS_K:
+        docs = (await top_deals.read(name, MATCH))[:limit]
+    else:
+        query = {
+            "match_found": True,
+            "savings_abs": {"$gte": DEAL_MIN_SAVINGS_ABS},
+            "savings_pct": {"$gte": DEAL_MIN_SAVINGS_PCT},
+            **multi_after_filter(position, name),
+        }
+        docs = await MATCH.find(query, DEALS_PROJECTION).sort(DEALS_SORT).limit(limit).to_list(limit)
 
-        pct = savings_abs / amz_price
-        if pct < 0.05:
-            continue
+    return [{**d, "match_coll": name} for d in docs]
+
+def _multi_rank(doc: dict):
+    return (-doc["savings_abs"], doc["key_val"], doc["match_coll"])
+
+@app.get("/deals/google/all")
+async def deals_google_all(
+    match_colls: Optional[str] = Query(None, description="Comma-separated; default: every match_* collection"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+):
+    """
+    Best deals across categories in one call.
+
+    Every collection is asked for at most `limit + 1` deals concurrently
+    (materialized top-K when possible, otherwise one indexed keyset query),
+    then the already-sorted lists are k-way merged by savings with a heap.
+    Nothing beyond `limit + 1` rows per collection is read.
+
+    Each deal carries its `match_coll`. Paging: pass `next_cursor` back.
+    Only existing match_* collections are read; other names in
+    `match_colls` are ignored (`collections` lists the ones used).
+    """
+    names = await collections_with_prefix(db, MATCH_COLL_PREFIX)
+    if match_colls:
+        wanted = {n.strip() for n in match_colls.split(",")}
+        names = [n for n in names if n in wanted]
+
+    try:
+        position = decode_multi_cursor(cursor) if cursor else None
+    except Exception:
+        raise HTTPException(400, "Invalid cursor")
+
+    per_coll = await asyncio.gather(*(_category_deals(n, limit + 1, position) for n in names))
 
-        deals.append({
-            "amazon": amz,
-            "offers": offers,
-        })
+    merged = list(itertools.islice(heapq.merge(*per_coll, key=_multi_rank), limit + 1))
 
-        if len(deals) >= limit:
-            break
+    next_cursor = None
+    if len(merged) > limit:
+        merged = merged[:limit]
+        last = merged[-1]
+        next_cursor = encode_multi_cursor(last["savings_abs"], last["key_val"], last["match_coll"])
+
+    return {
+        "count": len(merged),
+        "collections": names,
+        "deals": [{**_deal_out(d), "match_coll": d["match_coll"]} for d in merged],
+        "next_cursor": next_cursor,
+    }
 
-    # Sort by absolute savings DESC
-    deals.sort(
-        key=lambda d: float(d["amazon"]["price"]) - float(d["offers"][0]["price"]),
-        reverse=True
+# Price History
+def _require_price_history():
+    if price_recorder.coll is None:
+        raise HTTPException(404, "Price history disabled (PRICE_HISTORY_COLL)")
+
+@app.get("/prices/drops")
+async def price_drops(
+    hours: float = Query(24, gt=0, le=24 * 90),
+    source: str = Query("amazon", pattern="^(amazon|offer)$"),
+    by: str = Query("abs", pattern="^(abs|pct)$"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    Biggest net price drops in the last `hours`
+    (price before the first change in the window -> latest price).
+    source=amazon: Amazon list price, source=offer: best matched offer.
+    """
+    _require_price_history()
+    drops = await price_recorder.biggest_drops(hours, source=source, limit=limit, by=by)
+    return {"hours": hours, "source": source, "count": len(drops), "drops": drops}
+
+@app.get("/prices/{asin}")
+async def price_history(
+    asin: str,
+    source: Optional[str] = Query(None, pattern="^(amazon|offer)$"),
+    hours: Optional[float] = Query(None, gt=0),
+):
+    """
+    Price trajectory of one ASIN, oldest first. Only changes are stored,
+    so each point is the price from `t` until the next point.
+    """
+    _require_price_history()
+    points = await price_recorder.history(asin, source=source, hours=hours)
+    return {"asin": asin, "count": len(points), "history": points}
+
+# Streaming Ingest (scrape -> match pipeline)
+# Scraped products go straight through a bounded queue to the match
+# workers: matching starts with the first page, and a full queue makes
+# the scraper wait (backpressure) instead of racing ahead.
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "50"))
+# Smaller match batches than the bulk default so deals show up early
+INGEST_MATCH_BATCH = int(os.getenv("INGEST_MATCH_BATCH", "20"))
+
+async def _ingest_pipeline(
+    query: str,
+    pages: int,
+    max_products: int,
+    amz_coll: str,
+    match_coll: str,
+    concurrency: int = 4,
+    job: Optional[JobContext] = None,
+) -> dict:
+    """
+    Scrape `query` and match every accepted product as soon as its page
+    arrives (no re-read of amz_coll). `concurrency` match workers.
+    """
+    MATCH = await match_collection(db, match_coll)
+    writer = _match_writer(match_coll, MATCH, batch_size=INGEST_MATCH_BATCH)
+    stats = {"processed": 0, "misses": 0}
+    queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    feed = {"queued": 0, "already_indexed": 0}
+    started = time.monotonic()
+    first_indexed_s = None
+
+    if job:
+        await job.set_stage("ingest", total=0)
+
+    async def enqueue(docs: List[dict]):
+        # Skip ASINs indexed before (one $in per page), /google-shopping/refresh owns those
+        indexed = await existing_keys(MATCH, "key_val", (d["asin"] for d in docs))
+        for doc in docs:
+            if doc["asin"] in indexed:
+                feed["already_indexed"] += 1
+                continue
+            await queue.put(doc)    # waits while the match stage is behind
+            feed["queued"] += 1
+            if job:
+                job.progress["stage_total"] = feed["queued"]
+
+    async def produce() -> dict:
+        result = await _scrape_category(query, pages, max_products, amz_coll, job=job, sink=enqueue)
+        for _ in range(concurrency):
+            await queue.put(None)
+        return result
+
+    async def match_worker():
+        nonlocal first_indexed_s
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                await _index_tracked(item, writer, stats, job)
+                if first_indexed_s is None:
+                    first_indexed_s = round(time.monotonic() - started, 3)
+            except Exception as e:
+                print("Worker ERROR:", e)
+
+    producer = asyncio.ensure_future(produce())
+    tasks = [producer] + [asyncio.ensure_future(match_worker()) for _ in range(concurrency)]
+
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception():
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await writer.flush()
+        await price_recorder.flush()
+
+    return {
+        "scrape": producer.result(),
+        "index": {
+            "processed": stats["processed"],
+            "misses": stats["misses"],
+            "already_indexed": feed["already_indexed"],
+        },
+        "first_indexed_s": first_indexed_s,
+        "wall_s": round(time.monotonic() - started, 3),
+    }
+
+# Full Ingest (streaming scrape + match) as a background job
+async def _full_ingest_job(job: JobContext) -> dict:
+    """
+    Job handler: one streaming scrape -> match pass.
+
+    Scrape pages are checkpointed. Products of pages finished before a
+    restart may have been queued but not matched yet, so a resumed job
+    ends with an index pass over amz_coll (already-indexed ASINs skipped).
+    """
+    p = job.params
+    resumed = bool(job.checkpoint.get("pages_done"))
+
+    result = await _ingest_pipeline(
+        p["query"], p["pages"], p.get("max_products", 100),
+        p["amz_coll"], p["match_coll"], concurrency=p.get("concurrency", 4), job=job,
     )
 
-    return {"count": len(deals), "deals": deals[:limit]}
+    if resumed:
+        result["catch_up"] = await _index_category(
+            p["amz_coll"], p["match_coll"], concurrency=p.get("concurrency", 4), job=job
+        )
+
+    return result
+
+job_runner.register("full_ingest", _full_ingest_job)
 
-# Full Ingest (Amazon scrape, then Google index)
-@app.post("/amazon/full-ingest")
+@app.post("/amazon/full-ingest", status_code=202)
 async def amazon_full_ingest(
     query: str = Query(...),
     amz_coll: str = Query(...),
     match_coll: str = Query(...),
-    pages: int = 2
+    pages: int = Query(2, ge=1, le=10),
+    max_products: int = 100,
+    concurrency: int = Query(4, ge=1, le=32),
 ):
     """
-    Convenience endpoint:
-    Step 1: Scrape Amazon items
-    Step 2: Index them with Google Shopping
+    Convenience endpoint, now asynchronous and streaming:
+    Amazon items are matched with Google Shopping while later
+    pages are still being scraped (`concurrency` match workers).
+
+    Returns a job id immediately. Poll GET /jobs/{job_id} for progress,
+    cancel with POST /jobs/{job_id}/cancel. Jobs survive restarts.
     """
+    if not SERPAPI_KEY:
+        raise HTTPException(500, "SERPAPI_KEY not set")
 
-    await amazon_scrape_category(
-        AmazonScrapeReq(query=query, pages=pages),
-        amz_coll=amz_coll
-    )
+    job_id = await job_runner.submit("full_ingest", {
+        "query": query,
+        "amz_coll": amz_coll,
+        "match_coll": match_coll,
+        "pages": pages,
+        "max_products": max_products,
+        "concurrency": concurrency,
+    })
 
-    await google_index_by_title(
-        amz_coll=amz_coll,
-        match_coll=match_coll
-    )
+    return {"job_id": job_id, "status": "queued"}
 
-    return {"status": "complete"}
+# Jobs (status / list / cancel)
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Job status + progress: items done, SERP calls, errors and an ETA
+    for the current stage.
+    """
+    status = await job_runner.status(job_id)
+    if not status:
+        raise HTTPException(404, "Job not found")
+    return status
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = Query(None), limit: int = Query(20, ge=1, le=200)):
+    """Most recent jobs first."""
+    query = {"status": status} if status else {}
+    docs = await job_runner.coll.find(query).sort([("created_at", -1)]).limit(limit).to_list(limit)
+    return {"jobs": [describe_job(d) for d in docs]}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Request cancellation of a queued/running job."""
+    if not await job_runner.cancel(job_id):
+        raise HTTPException(404, "No active job with that id")
+    return {"job_id": job_id, "cancel_requested": True}
+
+# Debugging utility, SerpAPI cache hit/miss counters
+@app.get("/debug/cache-stats")
+async def cache_stats():
+    """
+    Report SerpAPI response cache counters per engine,
+    pHash / merchant-URL cache counters, title-analysis memo counters,
+    local offer catalog hits, request-coalescing counters
+    and the shared SerpAPI rate limiter state.
+    """
+    return {
+        "serp_rate_limit": serp_limiter.snapshot(),
+        "serp": serp_cache.snapshot(),
+        "phash": phash_cache.snapshot(),
+        "resolve": resolve_cache.snapshot(),
+        "titles": title_cache_stats(),
+        "offer_catalog": offer_catalog.snapshot(),
+        "price_history": price_recorder.snapshot(),
+        "singleflight": {
+            f.name: f.snapshot() for f in (serp_flight, image_flight, phash_flight, resolve_flight)
+        },
+    }
+
+# Prometheus metrics
+def _cache_stats() -> dict:
+    """(cache, engine) -> {"hits", "misses", "ratio"} from the existing snapshots."""
+    stats = {}
+    for engine, e in serp_cache.snapshot()["engines"].items():
+        stats[("serp", engine)] = (e["hits"] + e["mongo_hits"], e["misses"])
+    for name, snap in (("phash", phash_cache.snapshot()), ("resolve", resolve_cache.snapshot())):
+        stats[(name, "all")] = (snap["hits"] + snap["mongo_hits"] + snap["negative_hits"], snap["misses"])
+    titles = title_cache_stats()
+    stats[("titles", "all")] = (titles["hits"], titles["misses"])
+    catalog = offer_catalog.snapshot()
+    stats[("offer_catalog", "all")] = (catalog["hits"], catalog["misses"])
+    return {
+        key: {"hits": h, "misses": m, "ratio": h / (h + m) if h + m else None}
+        for key, (h, m) in stats.items()
+    }
+
+gauge_func(
+    "cache_hit_ratio", "Cache hit ratio since start", ("cache", "engine"),
+    lambda: {k: v["ratio"] for k, v in _cache_stats().items()},
+)
+gauge_func(
+    "cache_hits", "Cache hits since start", ("cache", "engine"),
+    lambda: {k: v["hits"] for k, v in _cache_stats().items()},
+)
+gauge_func(
+    "cache_misses", "Cache misses since start", ("cache", "engine"),
+    lambda: {k: v["misses"] for k, v in _cache_stats().items()},
+)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus text format:
+    - serp_request_seconds / serp_http_seconds / serp_http_requests_total /
+      serp_retries_total (per engine, 429 + timeout retries)
+    - scoring_stage_seconds (text_similarity, images, image_download, phash, match, total)
+    - http_request_seconds, mongo_commands_total (per endpoint), mongo_command_seconds
+    - cache_hit_ratio / cache_hits / cache_misses
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+# Debugging utility, index bootstrap results + index usage
+@app.get("/debug/index-stats")
+async def index_stats(coll: Optional[str] = Query(None)):
+    """
+    Report which indexes this process ensured (and any failures),
+    plus $indexStats usage counters per index.
+
+    Pass `coll` for one collection, otherwise every collection
+    touched since startup is reported.
+    """
+    names = [coll] if coll else sorted(index_report)
+    result = {}
+
+    for name in names:
+        try:
+            usage = await index_usage(db[name])
+        except Exception as e:
+            usage = {"error": str(e)}
+        result[name] = {"bootstrap": index_report.get(name), "usage": usage}
+
+    return result
+
+# Debugging utility, fill savings fields on match docs indexed before they existed
+@app.post("/debug/backfill-savings")
+async def debug_backfill_savings(match_coll: str = Query(...)):
+    """
+    One-off migration: compute savings_abs / savings_pct in Mongo
+    for older match docs so /deals/google can see them.
+    """
+    MATCH = await match_collection(db, match_coll)
+    updated = await backfill_savings(MATCH)
+    await top_deals.rebuild(match_coll, MATCH)
+    return {"updated": updated}
 
 # Debugging utility, Clears category collections
 @app.delete("/debug/clear-category")
@@ -417,5 +1319,6 @@ async def clear_category(
     if match_coll:
         res = await db[match_coll].delete_many({})
         result["match_deleted"] = res.deleted_count
+        await top_deals.invalidate(match_coll)
 
     return result
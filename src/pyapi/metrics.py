@@ -0,0 +1,239 @@
+import time, threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from pymongo import monitoring
+
+# Metrics
+# Small in-process counters/histograms rendered in the Prometheus text
+# format by GET /metrics. Recording is a dict lookup plus a bisect, and
+# cache ratios are only read from the existing snapshots at scrape time.
+
+# Seconds, from a cache hit up to a slow SerpAPI call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_values(labels: Tuple) -> Tuple[str, ...]:
+    # Always strings: an int status next to "timeout" would break sorting
+    return tuple(str(v) for v in labels)
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter per label values. Thread-safe (Mongo listener threads)."""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n: float = 1):
+        labels = _label_values(labels)
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in sorted(values):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_fmt(value)}")
+        return lines
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label values.
+
+        with stage_seconds.time("text"):
+            ...
+    """
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.series: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        labels = _label_values(labels)
+        with self._lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[bisect_left(self.buckets, value)] += 1
+            s[-1] += value
+
+    def time(self, *labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(s)) for labels, s in self.series.items()]
+        for labels, s in sorted(series):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                cumulative += n
+                le = 'le="' + _fmt(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_fmt(s[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: Tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class GaugeFunc:
+    """Gauge whose values are computed at scrape time: fn() -> {label values: value}."""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str], fn: Callable[[], Dict[Tuple, float]]):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Metrics ERROR ({self.name}):", e)
+            values = {}
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_fmt(float(value))}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def counter(name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+    return registry.register(Counter(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+def gauge_func(name: str, help: str, labelnames: Iterable[str], fn) -> GaugeFunc:
+    return registry.register(GaugeFunc(name, help, labelnames, fn))
+
+# Shared metrics
+serp_request_seconds = histogram(
+    "serp_request_seconds", "serp_get latency per engine and outcome (cache/fetch/error)",
+    ("engine", "outcome"),
+)
+serp_http_seconds = histogram(
+    "serp_http_seconds", "SerpAPI HTTP attempt latency per engine", ("engine",),
+)
+serp_http_total = counter(
+    "serp_http_requests_total", "SerpAPI HTTP attempts per engine and status", ("engine", "status"),
+)
+serp_retries_total = counter(
+    "serp_retries_total", "SerpAPI retries per engine and reason (429/timeout/network)", ("engine", "reason"),
+)
+scoring_stage_seconds = histogram(
+    "scoring_stage_seconds", "Deal scoring time per stage", ("stage",),
+)
+http_request_seconds = histogram(
+    "http_request_seconds", "HTTP request latency per endpoint", ("method", "endpoint", "status"),
+)
+mongo_commands_total = counter(
+    "mongo_commands_total", "MongoDB round trips per endpoint and command", ("endpoint", "command"),
+)
+mongo_command_seconds = histogram(
+    "mongo_command_seconds", "MongoDB command latency", ("command",),
+)
+
+# Endpoint attribution
+# Holds the ASGI scope of the request being served; the router fills in
+# scope["route"], so the endpoint label is resolved lazily.
+current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+def current_endpoint() -> str:
+    scope = current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency per route + Mongo attribution."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = current_scope.set(scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_request_seconds.observe(
+                time.perf_counter() - start, scope.get("method"), current_endpoint(), status["code"]
+            )
+            current_scope.reset(token)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    pymongo command listener. Motor copies the context into its executor
+    threads, so current_scope still points at the calling request.
+    """
+
+    def started(self, event):
+        mongo_commands_total.inc(current_endpoint(), event.command_name)
+
+    def succeeded(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, TypedDict
+from typing import List, Optional, TypedDict
 
 # AmazonScrapeReq
 # Used by: /amazon/scrape-category
@@ -31,3 +31,8 @@ class ExtensionFullProduct(BaseModel):
 
     # Can come from extension OR Amazon scraper
     image_url: Optional[str] = None
+
+# Sent by Chrome extension into /extension/find-deals/batch
+# (e.g. every product tile of an Amazon search results page)
+class ExtensionBatchReq(BaseModel):
+    products: List[ExtensionFullProduct] = Field(..., min_length=1, max_length=50)
@@ -0,0 +1,185 @@
+import os, asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import CollectionInvalid
+from store import ensure_indexes
+from utils import now_utc
+
+# Price History
+# Append-only observations in a MongoDB time-series collection:
+#   { t: datetime, m: { a: asin, s: "amazon" | "offer" }, p: price, q: previous price }
+# Only price moves are stored (change detection), so a price that never
+# changes costs one document no matter how often it is re-scraped.
+PRICE_HISTORY_RETENTION_DAYS = float(os.getenv("PRICE_HISTORY_RETENTION_DAYS", "365"))
+# A new observation is written when the price moved by at least this much
+PRICE_CHANGE_MIN_PCT = float(os.getenv("PRICE_CHANGE_MIN_PCT", "1.0"))
+PRICE_CHANGE_MIN_ABS = float(os.getenv("PRICE_CHANGE_MIN_ABS", "0.01"))
+PRICE_BATCH_SIZE = int(os.getenv("PRICE_BATCH_SIZE", "500"))
+# Last known price per (asin, source) kept in memory
+PRICE_LAST_MAXSIZE = int(os.getenv("PRICE_LAST_MAXSIZE", "200000"))
+
+def price_changed(old: Optional[float], new: float) -> bool:
+    if old is None:
+        return True
+    delta = abs(new - old)
+    return delta >= PRICE_CHANGE_MIN_ABS and delta >= abs(old) * PRICE_CHANGE_MIN_PCT / 100
+
+class PriceRecorder:
+    """
+    Buffers price observations and writes only the changed ones.
+
+    Usage (same shape as store.BulkWriter):
+        await price_recorder.add(asin, "amazon", price)   # flushes every PRICE_BATCH_SIZE
+        await price_recorder.flush()                      # at the end of a stage
+
+    On flush, previous prices missing from memory are fetched with one
+    aggregation for the whole batch, then changed prices are inserted
+    with one unordered insert_many.
+    """
+
+    def __init__(self, batch_size: int = PRICE_BATCH_SIZE):
+        self.coll = None
+        self.batch_size = max(1, batch_size)
+        self.pending: List[Tuple[str, str, float, datetime]] = []
+        self.last: Dict[Tuple[str, str], float] = {}
+        self._ready: Optional[asyncio.Task] = None
+        self.observed = 0
+        self.written = 0
+
+    def attach_mongo(self, coll):
+        self.coll = coll
+        self._ready = None
+
+    async def _ensure_collection(self):
+        try:
+            await self.coll.database.create_collection(
+                self.coll.name,
+                timeseries={"timeField": "t", "metaField": "m", "granularity": "hours"},
+                expireAfterSeconds=int(PRICE_HISTORY_RETENTION_DAYS * 86400),
+            )
+        except CollectionInvalid:
+            pass    # already exists
+        except Exception as e:
+            # No time-series support (old server): plain collection still works
+            print("Price history time-series ERROR:", e)
+        await ensure_indexes(self.coll, "prices")
+
+    async def ready(self):
+        """Create the collection + indexes once per process."""
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._ensure_collection())
+        await asyncio.shield(self._ready)
+
+    async def add(self, asin: str, source: str, price: Optional[float], t: Optional[datetime] = None):
+        if self.coll is None or not asin or price is None:
+            return
+        self.pending.append((asin, source, float(price), t or now_utc()))
+        self.observed += 1
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+
+    async def _load_last(self, keys: List[Tuple[str, str]]):
+        missing = [k for k in keys if k not in self.last]
+        if not missing:
+            return
+        pipeline = [
+            {"$match": {"m.a": {"$in": sorted({a for a, _ in missing})}}},
+            {"$sort": {"t": 1}},
+            {"$group": {"_id": "$m", "p": {"$last": "$p"}}},
+        ]
+        async for doc in self.coll.aggregate(pipeline):
+            self.last[(doc["_id"]["a"], doc["_id"]["s"])] = doc["p"]
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        # Swap before awaiting so concurrent add() calls start a new batch
+        batch, self.pending = self.pending, []
+
+        try:
+            await self.ready()
+            await self._load_last([(a, s) for a, s, _, _ in batch])
+
+            # Latest price per series in this batch; only becomes self.last
+            # once written, so a failed insert is retried on the next change check
+            latest: Dict[Tuple[str, str], float] = {}
+            docs = []
+            for asin, source, price, t in batch:
+                key = (asin, source)
+                prev = latest[key] if key in latest else self.last.get(key)
+                if not price_changed(prev, price):
+                    continue
+                docs.append({"t": t, "m": {"a": asin, "s": source}, "p": price, "q": prev})
+                latest[key] = price
+
+            if docs:
+                await self.coll.insert_many(docs, ordered=False)
+                self.written += len(docs)
+            self.last.update(latest)
+        except Exception as e:
+            print("Price history write ERROR:", e)
+
+        # Bound memory (oldest entries first, dicts keep insertion order)
+        while len(self.last) > PRICE_LAST_MAXSIZE:
+            self.last.pop(next(iter(self.last)))
+
+    async def history(self, asin: str, source: Optional[str] = None, hours: Optional[float] = None) -> List[dict]:
+        query: dict = {"m.a": asin}
+        if source:
+            query["m.s"] = source
+        if hours:
+            query["t"] = {"$gte": now_utc() - timedelta(hours=hours)}
+        cursor = self.coll.find(query, {"_id": 0}).sort([("t", 1)])
+        return [
+            {"t": d["t"], "source": d["m"]["s"], "price": d["p"], "previous": d.get("q")}
+            async for d in cursor
+        ]
+
+    async def biggest_drops(self, hours: float, source: str = "amazon", limit: int = 50, by: str = "abs") -> List[dict]:
+        """
+        Largest net price drops within the last `hours`: price before the
+        first change in the window (q, or p for a first-ever observation)
+        vs the latest price (p).
+        """
+        sort_field = "drop_pct" if by == "pct" else "drop_abs"
+        pipeline = [
+            {"$match": {"m.s": source, "t": {"$gte": now_utc() - timedelta(hours=hours)}}},
+            {"$sort": {"t": 1}},
+            {"$group": {
+                "_id": "$m.a",
+                "from": {"$first": {"$ifNull": ["$q", "$p"]}},
+                "to": {"$last": "$p"},
+                "since": {"$first": "$t"},
+                "changes": {"$sum": 1},
+            }},
+            {"$match": {"from": {"$gt": 0}}},
+            {"$set": {"drop_abs": {"$subtract": ["$from", "$to"]}}},
+            {"$match": {"drop_abs": {"$gt": 0}}},
+            {"$set": {"drop_pct": {"$multiply": [{"$divide": ["$drop_abs", "$from"]}, 100]}}},
+            {"$sort": {sort_field: -1}},
+            {"$limit": limit},
+        ]
+        return [
+            {
+                "asin": d["_id"],
+                "from": d["from"],
+                "to": d["to"],
+                "drop_abs": round(d["drop_abs"], 2),
+                "drop_pct": round(d["drop_pct"], 2),
+                "changes": d["changes"],
+                "since": d["since"],
+            }
+            async for d in self.coll.aggregate(pipeline)
+        ]
+
+    def snapshot(self) -> dict:
+        return {
+            "observed": self.observed,
+            "written": self.written,
+            "pending": len(self.pending),
+            "last_known": len(self.last),
+        }
+
+# Module-level instance shared by scraping + indexing
+price_recorder = PriceRecorder()
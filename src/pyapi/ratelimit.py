@@ -0,0 +1,68 @@
+import os, time, asyncio
+
+# Token-Bucket Rate Limiter
+class TokenBucket:
+    """
+    Async token bucket shared by every coroutine that calls an API.
+
+    - `rate` tokens are added per second, up to `burst`
+    - acquire() waits until a token is available
+    - backoff(seconds) pauses ALL callers (used on HTTP 429)
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self.waits = 0
+        self.backoffs = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+
+            # Global pause after a 429
+            if now < self._paused_until:
+                self.waits += 1
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            self.waits += 1
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def backoff(self, seconds: float):
+        """Stop handing out tokens for `seconds` and drain the bucket."""
+        self.backoffs += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    def snapshot(self) -> dict:
+        self._refill(time.monotonic())
+        return {
+            "rate_per_sec": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            "waits": self.waits,
+            "backoffs": self.backoffs,
+        }
+
+# Shared SerpAPI limiter (all workers, all endpoints)
+SERP_RATE_PER_SEC = float(os.getenv("SERP_RATE_PER_SEC", "5"))
+SERP_RATE_BURST = int(os.getenv("SERP_RATE_BURST", "10"))
+
+serp_limiter = TokenBucket(SERP_RATE_PER_SEC, SERP_RATE_BURST)
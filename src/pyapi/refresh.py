@@ -0,0 +1,75 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Re-Index Scheduling
+# Every match doc carries `next_check_at`; /google-shopping/refresh only
+# re-queries docs whose time has come, most valuable/volatile first.
+REFRESH_BASE_TTL_HOURS = float(os.getenv("REFRESH_BASE_TTL_HOURS", "24"))
+REFRESH_MIN_TTL_HOURS = float(os.getenv("REFRESH_MIN_TTL_HOURS", "4"))
+REFRESH_MAX_TTL_HOURS = float(os.getenv("REFRESH_MAX_TTL_HOURS", "168"))
+# Misses retry after 1h, 2h, 4h ... capped
+MISS_RETRY_BASE_HOURS = float(os.getenv("MISS_RETRY_BASE_HOURS", "1"))
+MISS_RETRY_MAX_HOURS = float(os.getenv("MISS_RETRY_MAX_HOURS", "48"))
+
+def _best_price(doc: Optional[dict]) -> Optional[float]:
+    if not doc:
+        return None
+    top = doc.get("best_match") or {}
+    return top.get("price")
+
+def price_volatility(prev: Optional[dict], best_price: Optional[float]) -> float:
+    """
+    Exponential moving average of the relative move in the best offer
+    price between two index runs (0 = never moves).
+    """
+    prev_vol = (prev or {}).get("volatility") or 0.0
+    old = _best_price(prev)
+    if not old or best_price is None:
+        return prev_vol
+    change = abs(best_price - old) / old
+    return round(0.5 * prev_vol + 0.5 * change, 4)
+
+def refresh_priority(savings_abs: Optional[float], volatility: float) -> float:
+    """Bigger, jumpier deals are refreshed first."""
+    return round((savings_abs or 0.0) * (1 + volatility), 4)
+
+def next_check_at(
+    now: datetime,
+    match_found: bool,
+    savings_pct: Optional[float],
+    volatility: float,
+) -> datetime:
+    """
+    Per-item TTL:
+      - shrinks with deal size (stale big deals are the costly ones)
+      - shrinks with price volatility
+      - no-match items wait twice the base TTL
+    """
+    if not match_found:
+        hours = REFRESH_BASE_TTL_HOURS * 2
+    else:
+        hours = REFRESH_BASE_TTL_HOURS
+        hours /= 1 + max(savings_pct or 0.0, 0.0) / 20
+        hours /= 1 + 4 * volatility
+
+    hours = max(REFRESH_MIN_TTL_HOURS, min(REFRESH_MAX_TTL_HOURS, hours))
+    return now + timedelta(hours=hours)
+
+def next_miss_retry_at(now: datetime, miss_count: int) -> datetime:
+    """Exponential backoff for items whose Google Shopping lookup failed."""
+    hours = MISS_RETRY_BASE_HOURS * (2 ** max(0, miss_count - 1))
+    return now + timedelta(hours=min(hours, MISS_RETRY_MAX_HOURS))
+
+def due_filter(now: datetime) -> dict:
+    """
+    Match docs that need re-indexing. Docs written before scheduling
+    existed (no next_check_at) fall back to checked_at + base TTL.
+    """
+    return {"$or": [
+        {"next_check_at": {"$lte": now}},
+        {
+            "next_check_at": {"$exists": False},
+            "checked_at": {"$lte": now - timedelta(hours=REFRESH_BASE_TTL_HOURS)},
+        },
+    ]}
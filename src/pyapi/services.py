@@ -1,77 +1,133 @@
-import os, httpx, asyncio, random, difflib
+import os, time, httpx, asyncio, random
 from typing import Optional, List
 from fastapi import HTTPException
-from utils import parse_price, extract_price_from_text
+from utils import parse_price, extract_price_from_text, rank_candidates
 from models import Offer
+from http_client import get_http_client
+from cache import serp_cache, serp_cache_key
+from singleflight import SingleFlight
+from ratelimit import serp_limiter
+from jobs import note_serp_call
+from catalog import offer_catalog
+from metrics import serp_request_seconds, serp_http_seconds, serp_http_total, serp_retries_total
 
 # Load API key from environment
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 
+# Identical in-flight SerpAPI queries share one HTTP call
+serp_flight = SingleFlight("serp")
+
 # Core SerpAPI Request Helper
-async def serp_get(url: str, q: dict):
+async def serp_get(url: str, q: dict, bypass_cache: bool = False):
     """
     Wrapper around SerpAPI HTTP GET.
 
     Features:
-      - Adds API key + disables caching
-      - Retries on 429 with exponential backoff
+      - Serves repeat queries from the local TTL cache (per engine);
+        `bypass_cache` skips the lookup (the fresh payload is still stored)
+      - Coalesces identical concurrent queries into one HTTP call
+      - Waits on the shared token-bucket rate limiter before each call
+      - Adds API key + disables SerpAPI-side caching
+      - Retries on 429, pausing the shared limiter (Retry-After aware)
       - Retries on network errors/timeouts
       - Raises HTTPException on fatal errors
+      - Latency per engine/outcome, HTTP attempts, retries -> /metrics
     """
     if not SERPAPI_KEY:
         raise HTTPException(500, "SERPAPI_KEY not set")
 
+    # Local response cache (keyed by engine + normalized params)
+    engine = q.get("engine") or "unknown"
+    start = time.perf_counter()
+    cache_key = serp_cache_key(url, q)
+    cached = None if bypass_cache else await serp_cache.get(cache_key, engine)
+    if cached is not None:
+        serp_request_seconds.observe(time.perf_counter() - start, engine, "cache")
+        return cached
+
+    try:
+        data = await serp_flight.do(cache_key, _serp_fetch, url, q, cache_key, engine)
+    except Exception:
+        serp_request_seconds.observe(time.perf_counter() - start, engine, "error")
+        raise
+    serp_request_seconds.observe(time.perf_counter() - start, engine, "fetch")
+    return data
+
+def _retry_after(r: httpx.Response) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds form only)."""
+    try:
+        return float(r.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+async def _serp_fetch(url: str, q: dict, cache_key: str, engine: str):
+    """HTTP + retry loop behind serp_get (one run per in-flight key)."""
     # Inject API key + no cache
     q = {**q, "api_key": SERPAPI_KEY, "no_cache": "true"}
 
     # API calls can be slow, increase timeout
     timeout = httpx.Timeout(connect=20.0, read=45.0, write=20.0, pool=20.0)
 
-    async with httpx.AsyncClient(timeout=timeout) as c:
-        last_err = None
-
-        # Up to 5 retry attempts
-        for attempt in range(5):
-            try:
-                r = await c.get(url, params=q)
-
-                # Error handling
-                if r.status_code >= 400:
-                    # Try decoding JSON detail
-                    try:
-                        detail = r.json()
-                    except:
-                        detail = {"text": r.text}
-
-                    # Handle rate limit with retry
-                    if r.status_code == 429 and attempt < 4:
-                        await asyncio.sleep(1.5 * (2 ** attempt) + random.random())
-                        continue
-
-                    raise HTTPException(r.status_code, detail)
-
-                return r.json()
-
-            except httpx.ReadTimeout as e:
-                last_err = e
-                if attempt < 4:
-                    await asyncio.sleep(0.8 * (2 ** attempt) + random.random())
-                    continue
-                raise HTTPException(504, "SerpAPI request timed out")
-
-            except (httpx.ConnectError, httpx.RemoteProtocolError) as e:
-                last_err = e
-                if attempt < 4:
-                    await asyncio.sleep(0.6 * (2 ** attempt) + random.random())
+    # Shared pooled client (keep-alive across calls)
+    c = get_http_client()
+    last_err = None
+
+    # Up to 5 retry attempts
+    for attempt in range(5):
+        try:
+            await serp_limiter.acquire()
+            note_serp_call()
+            with serp_http_seconds.time(engine):
+                r = await c.get(url, params=q, timeout=timeout)
+            serp_http_total.inc(engine, str(r.status_code))
+
+            # Error handling
+            if r.status_code >= 400:
+                # Try decoding JSON detail
+                try:
+                    detail = r.json()
+                except:
+                    detail = {"text": r.text}
+
+                # Handle rate limit with retry: pause every caller, not just this one
+                if r.status_code == 429 and attempt < 4:
+                    serp_retries_total.inc(engine, "429")
+                    serp_limiter.backoff(_retry_after(r) or 1.5 * (2 ** attempt) + random.random())
                     continue
-                raise HTTPException(502, "Network error calling SerpAPI")
 
-        raise HTTPException(502, str(last_err) or "Unknown SerpAPI error")
+                raise HTTPException(r.status_code, detail)
+
+            data = r.json()
+            # A 200 can still carry {"error": ...} (transient), don't replay it for a TTL
+            if not data.get("error"):
+                await serp_cache.set(cache_key, engine, data)
+            return data
+
+        except httpx.ReadTimeout as e:
+            last_err = e
+            serp_http_total.inc(engine, "timeout")
+            if attempt < 4:
+                serp_retries_total.inc(engine, "timeout")
+                await asyncio.sleep(0.8 * (2 ** attempt) + random.random())
+                continue
+            raise HTTPException(504, "SerpAPI request timed out")
+
+        except (httpx.ConnectError, httpx.RemoteProtocolError) as e:
+            last_err = e
+            serp_http_total.inc(engine, "network_error")
+            if attempt < 4:
+                serp_retries_total.inc(engine, "network")
+                await asyncio.sleep(0.6 * (2 ** attempt) + random.random())
+                continue
+            raise HTTPException(502, "Network error calling SerpAPI")
+
+    raise HTTPException(502, str(last_err) or "Unknown SerpAPI error")
 
 # Google Shopping Provider
-async def provider_google_shopping(query: str) -> List[Offer]:
+async def provider_google_shopping(query: str, bypass_cache: bool = False) -> List[Offer]:
     """
-    Fetch Google Shopping results for a given query.
+    Fetch Google Shopping results for a given query
+    (`bypass_cache`: skip the SERP response cache, see serp_get).
     Returns a list of Offer dicts with:
       - title
       - price
@@ -88,6 +144,7 @@ async def provider_google_shopping(query: str) -> List[Offer]:
             "gl": "us",
             "product_link": "true",
         },
+        bypass_cache=bypass_cache,
     )
 
     results = data.get("shopping_results") or []
@@ -119,9 +176,15 @@ async def provider_google_shopping(query: str) -> List[Offer]:
             )
         )
 
+    # Keep every offer for local lookups (/extension/find-deals)
+    offer_catalog.add(offers)
+
     return offers
 
 # Google Search Provider (for link resolution)
+# Minimum candidate score for a resolved link
+LINK_MIN_SCORE = 0.40
+
 async def provider_google_search(
     query: str,
     expected_title: str = "",
@@ -132,6 +195,7 @@ async def provider_google_search(
       1. Checking Google Shopping results (best quality)
       2. Falling back to organic Google Search results
       3. Scoring based on title similarity & price distance
+         (all candidates ranked in one batch, see utils.rank_candidates)
     """
 
     data = await serp_get(
@@ -145,73 +209,53 @@ async def provider_google_search(
     )
 
     domain = query.split(" ")[0].lower()
-    expected_title_norm = expected_title.lower().strip()
-
-    shopping = data.get("shopping_results") or []
-
-    best_score = -1
-    best_link = None
-
-    # Pass 1: Google Shopping
-    for r in shopping:
-        link = r.get("link")
-        title = (r.get("title") or "").lower()
-        price = parse_price(r.get("extracted_price") or r.get("price"))
-        source = (r.get("source") or "").lower()
-
-        if not link:
-            continue
-
-        # Stronger domain requirement
-        if domain not in source:
-            continue
-
-        title_sim = difflib.SequenceMatcher(None, title, expected_title_norm).ratio()
-
-        price_sim = 0
-        if expected_price and price:
-            diff_pct = abs(price - expected_price) / max(expected_price, 1)
-            price_sim = max(0, 1 - diff_pct)
+    ranked = rank_candidates(link_candidates(data, domain), expected_title, expected_price)
 
-        score = (title_sim * 0.75) + (price_sim * 0.25)
+    # Pass 1: Google Shopping (best quality), Pass 2: organic fallback
+    for kind in ("shopping", "organic"):
+        best = next((c for c in ranked if c["kind"] == kind), None)
+        if best and best["score"] >= LINK_MIN_SCORE:
+            return best["link"]
 
-        if score > best_score:
-            best_score = score
-            best_link = link
+    return None
 
-    if best_link and best_score >= 0.40:
-        return best_link
-
-    # Pass 2: Organic results fallback
-    organic = data.get("organic_results") or []
+def link_candidates(data: dict, domain: str) -> List[dict]:
+    """
+    Google Search results on `domain` as rank_candidates() input:
+      - shopping_results: domain must be in the source, 75% title / 25% price
+      - organic_results: domain must be in the link, 70% title / 30% price,
+        price read from title + snippet
+    """
+    candidates = []
 
-    for r in organic:
+    for r in data.get("shopping_results") or []:
         link = r.get("link")
-        title = (r.get("title") or "").lower()
-        snippet = r.get("snippet", "")
-
-        if not link:
+        if not link or domain not in (r.get("source") or "").lower():
             continue
-
-        if domain not in link.lower():
+        candidates.append({
+            "kind": "shopping",
+            "link": link,
+            "title": r.get("title") or "",
+            "price": parse_price(r.get("extracted_price") or r.get("price")),
+            "title_weight": 0.75,
+            "price_weight": 0.25,
+        })
+
+    for r in data.get("organic_results") or []:
+        link = r.get("link")
+        if not link or domain not in link.lower():
             continue
-
-        title_sim = difflib.SequenceMatcher(None, title, expected_title_norm).ratio()
-
-        found_price = extract_price_from_text(title + " " + snippet)
-        price_sim = 0
-
-        if expected_price and found_price:
-            diff_pct = abs(found_price - expected_price) / max(expected_price, 1)
-            price_sim = max(0, 1 - diff_pct)
-
-        score = (title_sim * 0.70) + (price_sim * 0.30)
-
-        if score > best_score:
-            best_score = score
-            best_link = link
-
-    return best_link if best_score >= 0.40 else None
+        title = r.get("title") or ""
+        candidates.append({
+            "kind": "organic",
+            "link": link,
+            "title": title,
+            "price": extract_price_from_text(title.lower() + " " + r.get("snippet", "")),
+            "title_weight": 0.70,
+            "price_weight": 0.30,
+        })
+
+    return candidates
 
 
 # Amazon SERP Provider
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# Single-Flight Request Coalescing
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one shared task.
+
+    The first caller for a key starts the work; everyone else who asks
+    for the same key while it is still running awaits the same task.
+
+    Semantics:
+      - Results and exceptions are delivered to every waiter
+      - A cancelled caller never cancels the shared work for others
+      - The shared work is cancelled only when its last waiter leaves
+      - The key is forgotten as soon as the work finishes (no caching)
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def _forget(self, key: Hashable, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Mark exception as retrieved so asyncio does not log it
+        # when every waiter already went away.
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            call = _Call(task)
+            self._calls[key] = call
+            task.add_done_callback(lambda t, k=key, c=call: self._forget(k, c, t))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            # shield(): cancelling this caller must not cancel the shared task
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Forget it now: a caller arriving before the done-callback
+                # runs must start fresh work, not join a cancelled task
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,271 @@
+import os, re, json, base64, asyncio
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Bulk Write Settings
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+
+# Buffered Bulk Writer
+class BulkWriter:
+    """
+    Buffer UpdateOne operations and flush them with one unordered
+    bulk_write per batch (instead of one round trip per document).
+
+    Usage:
+        writer = BulkWriter(db[coll])
+        await writer.add(UpdateOne(...))   # flushes every `batch_size` ops
+        await writer.flush()               # always flush at the end
+
+    `after_flush(docs)` (optional) is awaited after each flush with the
+    docs passed to add(), so derived data can follow the writes.
+    """
+
+    def __init__(self, coll, batch_size: int = BULK_BATCH_SIZE, after_flush=None):
+        self.coll = coll
+        self.batch_size = max(1, batch_size)
+        self.after_flush = after_flush
+        self.ops: List[UpdateOne] = []
+        self.docs: List[dict] = []
+        self.flushes = 0
+        self.upserted = 0
+        self.modified = 0
+        self.errors = 0
+
+    async def add(self, op: UpdateOne, doc: Optional[dict] = None):
+        self.ops.append(op)
+        if doc is not None:
+            self.docs.append(doc)
+        if len(self.ops) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self.ops:
+            return
+
+        # Swap before awaiting so concurrent add() calls start a new batch
+        ops, self.ops = self.ops, []
+        docs, self.docs = self.docs, []
+        self.flushes += 1
+
+        try:
+            res = await self.coll.bulk_write(ops, ordered=False)
+            self.upserted += res.upserted_count
+            self.modified += res.modified_count
+        except BulkWriteError as e:
+            # Unordered: everything except the failed ops was still applied
+            details = e.details or {}
+            write_errors = details.get("writeErrors") or []
+            self.errors += len(write_errors)
+            self.upserted += details.get("nUpserted", 0)
+            self.modified += details.get("nModified", 0)
+            print("Bulk write ERROR:", write_errors[:3])
+
+        if self.after_flush and docs:
+            try:
+                await self.after_flush(docs)
+            except Exception as e:
+                print("Bulk after_flush ERROR:", e)
+
+    def snapshot(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "upserted": self.upserted,
+            "modified": self.modified,
+            "errors": self.errors,
+        }
+
+# Prefetch Helpers
+async def existing_keys(coll, field: str, values: Iterable) -> Set:
+    """
+    Return which of `values` already exist in `coll.<field>`,
+    using one $in query instead of one find_one per value.
+    """
+    values = [v for v in values if v]
+    if not values:
+        return set()
+
+    cursor = coll.find({field: {"$in": values}}, {"_id": 0, field: 1})
+    return {doc.get(field) async for doc in cursor}
+
+# Index Bootstrap
+# Collection names are chosen at runtime (amz_coll / match_coll), so
+# indexes are ensured the first time this process touches a name.
+INDEX_SPECS: Dict[str, list] = {
+    "amazon": [
+        ([("asin", ASCENDING)], {"name": "asin_unique", "unique": True}),
+        ([("updatedAt", DESCENDING)], {"name": "updated_desc"}),
+    ],
+    "match": [
+        ([("key_val", ASCENDING)], {"name": "key_val_unique", "unique": True}),
+        # /deals/google: match_found filter + savings sort (key_val = keyset tie-breaker)
+        ([("match_found", ASCENDING), ("savings_abs", DESCENDING), ("key_val", ASCENDING)],
+         {"name": "match_savings"}),
+        ([("checked_at", ASCENDING)], {"name": "checked_at"}),
+        # /google-shopping/refresh: due items
+        ([("next_check_at", ASCENDING)], {"name": "next_check_at"}),
+    ],
+    # Price history (time-series): per-ASIN history, drops per source
+    "prices": [
+        ([("m.a", ASCENDING), ("m.s", ASCENDING), ("t", ASCENDING)], {"name": "asin_source_t"}),
+        ([("m.s", ASCENDING), ("t", ASCENDING)], {"name": "source_t"}),
+    ],
+    # SerpAPI response cache / pHash cache: Mongo purges expired docs itself
+    "cache": [
+        ([("expires_at", ASCENDING)], {"name": "expires_ttl", "expireAfterSeconds": 0}),
+    ],
+    # Offer catalog: TTL like "cache", plus the freshest-first startup load
+    "catalog": [
+        ([("expires_at", ASCENDING)], {"name": "expires_ttl", "expireAfterSeconds": 0}),
+        ([("seen_at", DESCENDING)], {"name": "seen_at_desc"}),
+    ],
+}
+
+# coll name -> task creating its indexes (shared by concurrent first users)
+_index_tasks: Dict[str, asyncio.Task] = {}
+# coll name -> {"kind": ..., "created": [...], "errors": [...]}
+index_report: Dict[str, dict] = {}
+
+async def _create_indexes(coll, kind: str):
+    report = {"kind": kind, "created": [], "errors": []}
+    index_report[coll.name] = report
+
+    for keys, opts in INDEX_SPECS[kind]:
+        try:
+            report["created"].append(await coll.create_index(keys, **opts))
+        except Exception as e:
+            # e.g. duplicate ASINs already stored block a unique index
+            print(f"Index ERROR ({coll.name}.{opts.get('name')}):", e)
+            report["errors"].append({"index": opts.get("name"), "error": str(e)})
+
+async def ensure_indexes(coll, kind: str):
+    """
+    Create the indexes for `kind` on `coll` once per process.
+    Failures are logged and reported, never raised (queries still work).
+    """
+    task = _index_tasks.get(coll.name)
+    if task is None:
+        task = asyncio.ensure_future(_create_indexes(coll, kind))
+        _index_tasks[coll.name] = task
+    await asyncio.shield(task)
+
+async def amazon_collection(db, name: str):
+    """db[name] with Amazon product indexes ensured."""
+    coll = db[name]
+    await ensure_indexes(coll, "amazon")
+    return coll
+
+async def match_collection(db, name: str):
+    """db[name] with match/deal indexes ensured."""
+    coll = db[name]
+    await ensure_indexes(coll, "match")
+    return coll
+
+async def existing_collection(db, name: Optional[str]):
+    """
+    db[name] if that collection already exists, else None.
+
+    Read paths take names from query params, so they use this instead of
+    amazon_collection / match_collection: an unknown name never creates a
+    collection or indexes.
+    """
+    if not name:
+        return None
+    if name in _index_tasks:
+        # Written by this process
+        return db[name]
+    found = await db.list_collection_names(filter={"name": name})
+    return db[name] if found else None
+
+async def collections_with_prefix(db, prefix: str) -> List[str]:
+    """Existing collection names starting with `prefix` (matched literally)."""
+    return sorted(await db.list_collection_names(
+        filter={"name": {"$regex": "^" + re.escape(prefix)}}
+    ))
+
+async def index_usage(coll) -> List[dict]:
+    """Per-index access counters via $indexStats."""
+    stats = []
+    async for s in coll.aggregate([{"$indexStats": {}}]):
+        stats.append({
+            "name": s.get("name"),
+            "key": s.get("key"),
+            "ops": (s.get("accesses") or {}).get("ops"),
+            "since": (s.get("accesses") or {}).get("since"),
+        })
+    return stats
+
+# Savings Backfill
+# Match docs written before savings were stored at index time
+SAVINGS_BACKFILL_PIPELINE = [
+    {"$set": {"_top": {"$arrayElemAt": [{"$ifNull": ["$offers", "$best_deals"]}, 0]}}},
+    {"$set": {
+        "_amz": {"$convert": {"input": "$amazon.price", "to": "double", "onError": None, "onNull": None}},
+        "_other": {"$convert": {"input": "$_top.price", "to": "double", "onError": None, "onNull": None}},
+    }},
+    {"$set": {"savings_abs": {"$round": [{"$subtract": ["$_amz", "$_other"]}, 2]}}},
+    {"$set": {"savings_pct": {"$cond": [
+        {"$gt": ["$_amz", 0]},
+        {"$round": [{"$multiply": [{"$divide": ["$savings_abs", "$_amz"]}, 100]}, 2]},
+        0,
+    ]}}},
+    {"$unset": ["_top", "_amz", "_other"]},
+]
+
+async def backfill_savings(coll) -> int:
+    """Compute savings_abs / savings_pct server-side for docs missing them."""
+    res = await coll.update_many(
+        {"match_found": True, "savings_abs": {"$exists": False}},
+        SAVINGS_BACKFILL_PIPELINE,
+    )
+    return res.modified_count
+
+# Keyset Pagination (deals sorted by savings_abs DESC, key_val ASC)
+DEALS_SORT = [("savings_abs", DESCENDING), ("key_val", ASCENDING)]
+
+def encode_deals_cursor(savings_abs: float, key_val: str) -> str:
+    """Opaque token pointing just after (savings_abs, key_val)."""
+    raw = json.dumps([savings_abs, key_val], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_deals_cursor(token: str) -> Tuple[float, str]:
+    """Inverse of encode_deals_cursor. Raises ValueError on a bad token."""
+    padded = token + "=" * (-len(token) % 4)
+    savings_abs, key_val = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return float(savings_abs), str(key_val)
+
+def after_cursor_filter(token: Optional[str]) -> dict:
+    """Mongo filter selecting deals strictly after the cursor position."""
+    if not token:
+        return {}
+    savings_abs, key_val = decode_deals_cursor(token)
+    return {"$or": [
+        {"savings_abs": {"$lt": savings_abs}},
+        {"savings_abs": savings_abs, "key_val": {"$gt": key_val}},
+    ]}
+
+# Keyset Pagination across match collections
+# Global order: savings_abs DESC, key_val ASC, collection name ASC
+# (the same ASIN can be a deal in two categories)
+def encode_multi_cursor(savings_abs: float, key_val: str, coll: str) -> str:
+    """Opaque token pointing just after (savings_abs, key_val, coll)."""
+    raw = json.dumps([savings_abs, key_val, coll], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_multi_cursor(token: str) -> Tuple[float, str, str]:
+    """Inverse of encode_multi_cursor. Raises ValueError on a bad token."""
+    padded = token + "=" * (-len(token) % 4)
+    savings_abs, key_val, coll = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return float(savings_abs), str(key_val), str(coll)
+
+def multi_after_filter(position: Optional[Tuple[float, str, str]], coll: str) -> dict:
+    """Filter for `coll` selecting deals strictly after the global position."""
+    if not position:
+        return {}
+    savings_abs, key_val, after_coll = position
+    # Same (savings, key_val) in a later-sorting collection is still ahead
+    key_op = "$gte" if coll > after_coll else "$gt"
+    return {"$or": [
+        {"savings_abs": {"$lt": savings_abs}},
+        {"savings_abs": savings_abs, "key_val": {key_op: key_val}},
+    ]}
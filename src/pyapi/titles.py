@@ -0,0 +1,101 @@
+import os, re
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+# Title Analysis
+# Every title is parsed once: normalized tokens, size, pack count and the
+# multipack flag come out of the same call. The same titles come back all
+# the time (Amazon items on refresh, Google offers across requests), so
+# results are memoized per title.
+TITLE_CACHE_SIZE = int(os.getenv("TITLE_CACHE_SIZE", "50000"))
+
+# Words to remove when normalizing product titles
+STOPWORDS = frozenset({
+    "with", "and", "the", "for", "in", "of", "to", "by", "on",
+    "oz", "fl", "ct", "pack", "count", "lb", "lbs", "ounce", "ounces",
+})
+
+# Anything that is not a lowercase letter, digit or space
+NON_ALNUM_RE = re.compile(r"[^a-z0-9 ]+")
+
+# Size / quantity parser:
+# Matches things like "12 oz", "1 lb", "pack of 3", "3 ct", "3-pack"
+SIZE_RE = re.compile(
+    r"(?:(\d+(?:\.\d+)?)\s*(lb|lbs|pound|pounds|oz|ounce|ounces|kg|g|gram|grams|ml|l|liter|liters))"
+    r"|(?:pack\s*of\s*(\d+)|(\d+)\s*ct|\b(\d+)-?pack\b)",
+    re.I,
+)
+# Same pattern for already-lowercased text (case-insensitive matching is slower)
+_SIZE_LOWER_RE = re.compile(SIZE_RE.pattern)
+
+# Multipacks / bundles / bulk sizes (scrape filter), all rules in one pattern:
+# "pack of", "6 pack", "3 bundle", "12 ct", "4pk", "2 x 16"
+MULTIPACK_RE = re.compile(
+    r"pack of"
+    r"|\b\d+\s*(?:(?:pack|packet|bundle|variety|ct|count|pk)\b|x\s*\d)"
+)
+
+_GRAMS_PER_UNIT = {
+    "lb": 453.59237, "lbs": 453.59237, "pound": 453.59237, "pounds": 453.59237,
+    "oz": 28.349523125, "ounce": 28.349523125, "ounces": 28.349523125,
+    "kg": 1000.0,
+    "g": 1.0, "gram": 1.0, "grams": 1.0,
+    "ml": 1.0,
+    "l": 1000.0, "liter": 1000.0, "liters": 1000.0,
+}
+
+def to_grams(val: float, unit: str) -> Optional[float]:
+    """Convert various units to grams (or ml equivalently for liquids)."""
+    factor = _GRAMS_PER_UNIT.get(unit.lower())
+    return val * factor if factor is not None else None
+
+class TitleInfo(NamedTuple):
+    norm: str                  # lowercase, punctuation + STOPWORDS removed
+    tokens: Tuple[str, ...]    # norm split into words
+    grams: Optional[float]     # largest size found (grams or ml)
+    count: int                 # largest pack count found (default 1)
+    multipack: bool            # multipack / bundle / bulk title
+
+EMPTY_TITLE = TitleInfo("", (), None, 1, False)
+
+@lru_cache(maxsize=TITLE_CACHE_SIZE)
+def _analyze(title: str) -> TitleInfo:
+    lower = title.lower()
+
+    tokens = tuple(t for t in NON_ALNUM_RE.sub(" ", lower).split() if t not in STOPWORDS)
+
+    grams = None
+    count = 1
+    for m in _SIZE_LOWER_RE.finditer(lower):
+        qty, unit, pack_of, ct_alt, pack_alt = m.groups()
+
+        # Quantity+unit (e.g., "12 oz")
+        if qty and unit:
+            g = to_grams(float(qty), unit)
+            if g:
+                grams = max(grams or 0, g)
+
+        # Handle pack sizes
+        for v in (pack_of, ct_alt, pack_alt):
+            if v and v.isdigit():
+                count = max(count, int(v))
+
+    multipack = MULTIPACK_RE.search(lower) is not None
+    return TitleInfo(" ".join(tokens), tokens, grams, count, multipack)
+
+def analyze_title(title: Optional[str]) -> TitleInfo:
+    """Parse a product title once (memoized). Empty/None titles are fine."""
+    if not title:
+        return EMPTY_TITLE
+    return _analyze(title)
+
+def title_cache_stats() -> dict:
+    info = _analyze.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": round(info.hits / lookups, 3) if lookups else None,
+    }
@@ -0,0 +1,179 @@
+import os, time, asyncio
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from store import DEALS_SORT, after_cursor_filter, encode_deals_cursor
+from utils import now_utc, DEAL_MIN_SAVINGS_ABS, DEAL_MIN_SAVINGS_PCT
+
+# Materialized Top-K Deals
+# One small document per match collection:
+#   { _id: match_coll, version, complete, deals: [...K entries...], updated_at }
+TOP_DEALS_K = int(os.getenv("TOP_DEALS_K", "200"))
+# How long a process trusts its cached copy before re-checking the version
+TOP_DEALS_CACHE_TTL = float(os.getenv("TOP_DEALS_CACHE_TTL", "5"))
+
+DEALS_QUERY = {
+    "match_found": True,
+    "savings_abs": {"$gte": DEAL_MIN_SAVINGS_ABS},
+    "savings_pct": {"$gte": DEAL_MIN_SAVINGS_PCT},
+}
+ENTRY_PROJECTION = {"_id": 0, "key_val": 1, "savings_abs": 1, "amazon": 1, "offers": 1}
+
+def qualifies(doc: dict) -> bool:
+    """Same rule as the /deals/google query."""
+    s_abs, s_pct = doc.get("savings_abs"), doc.get("savings_pct")
+    return (
+        bool(doc.get("match_found"))
+        and s_abs is not None and s_abs >= DEAL_MIN_SAVINGS_ABS
+        and s_pct is not None and s_pct >= DEAL_MIN_SAVINGS_PCT
+    )
+
+def _entry(doc: dict) -> dict:
+    return {k: doc.get(k) for k in ("key_val", "savings_abs", "amazon", "offers")}
+
+def _rank(entry: dict) -> Tuple[float, str]:
+    """Sort key matching DEALS_SORT (savings_abs DESC, key_val ASC)."""
+    return (-entry["savings_abs"], entry["key_val"])
+
+class TopDeals:
+    """
+    Keeps the top-K deals of every match collection materialized.
+
+    - apply() folds freshly written match docs into the list
+      (insert, re-rank, or drop when a match stops qualifying)
+    - When a drop leaves a truncated list short, it is refilled from
+      the match collection with one keyset query
+    - Writes use optimistic concurrency on `version`; on conflict
+      (another worker wrote first) the list is rebuilt
+    - read() serves from an in-process cache, re-validated by
+      fetching only `version` once TOP_DEALS_CACHE_TTL has passed
+    """
+
+    def __init__(self, coll, k: int = TOP_DEALS_K):
+        self.coll = coll
+        self.k = k
+        self._cache: Dict[str, Tuple[int, List[dict], float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    def _remember(self, name: str, version: int, deals: List[dict]):
+        self._cache[name] = (version, deals, time.monotonic())
+
+    async def _query(self, MATCH, limit: int, after: Optional[dict] = None) -> List[dict]:
+        cursor_filter = after_cursor_filter(
+            encode_deals_cursor(after["savings_abs"], after["key_val"]) if after else None
+        )
+        docs = await MATCH.find({**DEALS_QUERY, **cursor_filter}, ENTRY_PROJECTION) \
+            .sort(DEALS_SORT).limit(limit).to_list(limit)
+        return [_entry(d) for d in docs]
+
+    async def rebuild(self, name: str, MATCH) -> List[dict]:
+        """Recompute the whole list with one indexed query."""
+        deals = await self._query(MATCH, self.k + 1)
+        complete = len(deals) <= self.k
+        deals = deals[: self.k]
+
+        res = await self.coll.find_one_and_update(
+            {"_id": name},
+            {
+                "$set": {"deals": deals, "complete": complete, "updated_at": now_utc()},
+                "$inc": {"version": 1},
+            },
+            upsert=True,
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._remember(name, res["version"], deals)
+        return deals
+
+    async def apply(self, name: str, MATCH, docs: List[dict]):
+        """Fold just-upserted match docs into the materialized list."""
+        if not docs:
+            return
+
+        async with self._lock(name):
+            current = await self.coll.find_one({"_id": name})
+            if not current:
+                await self.rebuild(name, MATCH)
+                return
+
+            version = current.get("version", 0)
+            complete = current.get("complete", False)
+            entries = {e["key_val"]: e for e in current.get("deals") or []}
+            changed = False
+
+            for doc in docs:
+                key = doc.get("key_val")
+                if entries.pop(key, None) is not None:
+                    changed = True
+
+                if not qualifies(doc):
+                    continue
+
+                entry = _entry(doc)
+                worst = max(entries.values(), key=_rank) if entries else None
+
+                # A truncated list can only take entries that rank above its tail;
+                # anything lower is picked up by the refill below if it belongs.
+                if complete or (worst is not None and _rank(entry) < _rank(worst)):
+                    entries[key] = entry
+                    changed = True
+
+            if not changed:
+                return
+
+            deals = sorted(entries.values(), key=_rank)
+            if len(deals) > self.k:
+                deals = deals[: self.k]
+                complete = False
+
+            # Refill after drops (keyset query strictly after our last entry)
+            if not complete and len(deals) < self.k:
+                more = await self._query(MATCH, self.k - len(deals) + 1, after=deals[-1] if deals else None)
+                complete = len(more) <= self.k - len(deals)
+                deals += more[: self.k - len(deals)]
+
+            res = await self.coll.update_one(
+                {"_id": name, "version": version},
+                {"$set": {
+                    "deals": deals,
+                    "complete": complete,
+                    "version": version + 1,
+                    "updated_at": now_utc(),
+                }},
+            )
+
+            if res.matched_count == 0:
+                # Another process updated it first, start from the truth
+                await self.rebuild(name, MATCH)
+                return
+
+            self._remember(name, version + 1, deals)
+
+    async def read(self, name: str, MATCH) -> List[dict]:
+        """Top-K deals for `name`, usually without touching Mongo."""
+        cached = self._cache.get(name)
+        if cached and time.monotonic() - cached[2] < TOP_DEALS_CACHE_TTL:
+            return cached[1]
+
+        if cached:
+            head = await self.coll.find_one({"_id": name}, {"version": 1})
+            if head and head.get("version") == cached[0]:
+                self._remember(name, cached[0], cached[1])
+                return cached[1]
+
+        doc = await self.coll.find_one({"_id": name})
+        if not doc:
+            return await self.rebuild(name, MATCH)
+
+        deals = doc.get("deals") or []
+        self._remember(name, doc.get("version", 0), deals)
+        return deals
+
+    async def invalidate(self, name: str):
+        """Forget the materialized list (e.g. after clearing the collection)."""
+        self._cache.pop(name, None)
+        await self.coll.delete_one({"_id": name})
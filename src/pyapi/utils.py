@@ -1,31 +1,54 @@
-import re
+import os, re, time, asyncio
 from datetime import datetime, timezone
-from typing import Optional, Dict
-import httpx
-from PIL import Image
+from typing import Optional, Dict, List, Set, Tuple
 import imagehash
-from io import BytesIO
 from models import ExtensionFullProduct, Offer
-from rapidfuzz import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process
+from http_client import get_http_client
+from singleflight import SingleFlight
+from cache import phash_cache
+from imaging import phash_bytes, ImagePoolError
+from titles import analyze_title
+from metrics import scoring_stage_seconds
 
 # Regex Helpers
 
 # Price pattern: captures floats or ints like "12.99", "$19.00", "$19"
 PRICE_RE = re.compile(r"(\d+(?:\.\d{1,2})?)")
 
-# Words to remove when normalizing product titles
-STOPWORDS = {
-    "with", "and", "the", "for", "in", "of", "to", "by", "on",
-    "oz", "fl", "ct", "pack", "count", "lb", "lbs", "ounce", "ounces",
-}
+# Concurrency Helpers
+async def run_workers(items: list, worker, concurrency: int):
+    """
+    Run `await worker(item)` for every item with at most `concurrency`
+    running at once (a fixed pool of workers pulling from one queue).
 
-# Size / quantity parser:
-# Matches things like "12 oz", "1 lb", "pack of 3", "3 ct", "3-pack"
-SIZE_RE = re.compile(
-    r"(?:(\d+(?:\.\d+)?)\s*(lb|lbs|pound|pounds|oz|ounce|ounces|kg|g|gram|grams|ml|l|liter|liters))"
-    r"|(?:pack\s*of\s*(\d+)|(\d+)\s*ct|\b(\d+)-?pack\b)",
-    re.I,
-)
+    An exception in one item is printed and does not stop the others.
+    A BaseException (job cancellation) stops every worker and propagates.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for it in items:
+        queue.put_nowait(it)
+
+    async def _loop():
+        while True:
+            try:
+                it = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await worker(it)
+            except Exception as e:
+                print("Worker ERROR:", e)
+
+    n = max(1, min(concurrency, len(items)))
+    tasks = [asyncio.ensure_future(_loop()) for _ in range(n)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 # Time / Date Helpers
 def now_utc() -> datetime:
@@ -58,15 +81,24 @@ def parse_price(v) -> Optional[float]:
     return float(m.group(1)) if m else None
 
 # Image Downloading + pHash (perceptual hash)
+# Concurrent downloads of the same thumbnail share one request
+image_flight = SingleFlight("image")
+# Concurrent download + hash of the same thumbnail (across scorers) share one run
+phash_flight = SingleFlight("phash")
+
 async def fetch_image_bytes(url: str) -> Optional[bytes]:
     """Download image bytes with a 10s timeout. Returns None on failure."""
     if not url:
         return None
+    return await image_flight.do(url, _fetch_image_bytes, url)
+
+async def _fetch_image_bytes(url: str) -> Optional[bytes]:
     try:
-        async with httpx.AsyncClient(timeout=10.0) as c:
-            r = await c.get(url)
-            if r.status_code == 200:
-                return r.content
+        # Inside the single-flight: duplicates wait on the shared download, not on a slot
+        async with _phash_semaphore():
+            r = await get_http_client().get(url, timeout=10.0)
+        if r.status_code == 200:
+            return r.content
     except Exception:
         return None
     return None
@@ -75,16 +107,120 @@ async def compute_phash(url: str) -> Optional[imagehash.ImageHash]:
     """
     Compute perceptual hash for an image.
     Used for comparing Amazon vs Google Shopping images.
+
+    Checks the URL -> pHash cache first (memory, then Mongo);
+    failed downloads are negatively cached for a short TTL.
+    Decode + hashing runs in the image worker pool, not on the event loop.
     """
-    data = await fetch_image_bytes(url)
-    if not data:
-        return None
-    try:
-        img = Image.open(BytesIO(data)).convert("RGB")
-        return imagehash.phash(img)
-    except Exception:
+    if not url:
         return None
 
+    found, hex_hash = await phash_cache.get(url)
+    if not found:
+        try:
+            hex_hash = await phash_flight.do(url, _download_and_hash, url)
+        except ImagePoolError:
+            return None
+    return imagehash.hex_to_hash(hex_hash) if hex_hash else None
+
+async def _download_and_hash(url: str) -> Optional[str]:
+    """
+    Download + hash ONE image and cache the result (failures negatively).
+    Runs behind phash_flight, so concurrent scorers share bytes and hash.
+    ImagePoolError propagates uncached: a dead worker says nothing about the image.
+    """
+    with scoring_stage_seconds.time("image_download"):
+        data = await fetch_image_bytes(url)
+
+    hex_hash = None
+    if data:
+        with scoring_stage_seconds.time("phash"):
+            hex_hash = await phash_bytes(data)
+
+    phash_cache.set_many({url: hex_hash})
+    return hex_hash
+
+# Concurrent pHash (used by the scoring engine)
+# Max thumbnail GETs in flight at once (process-wide)
+PHASH_CONCURRENCY = int(os.getenv("PHASH_CONCURRENCY", "16"))
+# Per-request budget for image downloads inside one scoring pass
+SCORE_IMAGE_DEADLINE_S = float(os.getenv("SCORE_IMAGE_DEADLINE_S", "4.0"))
+
+_phash_sem: Optional[asyncio.Semaphore] = None
+_phash_sem_loop = None
+
+def _phash_semaphore() -> asyncio.Semaphore:
+    """Process-wide semaphore, rebuilt if the event loop changes (tests/scripts)."""
+    global _phash_sem, _phash_sem_loop
+    loop = asyncio.get_running_loop()
+    if _phash_sem is None or _phash_sem_loop is not loop:
+        _phash_sem = asyncio.Semaphore(PHASH_CONCURRENCY)
+        _phash_sem_loop = loop
+    return _phash_sem
+
+async def compute_phashes(
+    urls: List[Optional[str]],
+    deadline: Optional[float] = None,
+) -> Tuple[Dict[str, Optional[imagehash.ImageHash]], Set[str]]:
+    """
+    Hash many images concurrently under one deadline.
+
+    Steps:
+      1. Serve what we can from the pHash cache (one $in lookup)
+      2. Download + hash the rest concurrently; each URL runs once per
+         process (phash_flight), so overlapping scorers share the work,
+         and its result is cached as soon as it is hashed
+
+    `deadline` (defaults to SCORE_IMAGE_DEADLINE_S) covers the whole stage:
+    cache lookup, downloads and hashing.
+
+    Returns (hashes, timed_out):
+      - hashes: url -> ImageHash (or None if download/decode failed)
+      - timed_out: urls with no hash in time (or no verdict, e.g. pool crash)
+    """
+    if deadline is None:
+        deadline = SCORE_IMAGE_DEADLINE_S
+
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+
+    def remaining() -> float:
+        return max(0.0, stop_at - loop.time())
+
+    unique = list(dict.fromkeys(u for u in urls if u))
+    hashes: Dict[str, Optional[imagehash.ImageHash]] = {}
+    timed_out: Set[str] = set()
+
+    # 1. Cache
+    cached = await phash_cache.get_many(unique, timeout=remaining())
+    for u, hex_hash in cached.items():
+        hashes[u] = imagehash.hex_to_hash(hex_hash) if hex_hash else None
+    to_fetch = [u for u in unique if u not in cached]
+
+    if not to_fetch:
+        return hashes, timed_out
+
+    # 2. Download + hash (shared per URL)
+    tasks = {u: asyncio.ensure_future(phash_flight.do(u, _download_and_hash, u)) for u in to_fetch}
+    done, pending = await asyncio.wait(tasks.values(), timeout=remaining())
+
+    # Only our wait is dropped: work other scorers still wait on keeps going
+    for t in pending:
+        t.cancel()
+
+    for u, t in tasks.items():
+        if t not in done or t.cancelled():
+            # A cancelled run (shared work dropped by other callers) counts as late
+            timed_out.add(u)
+        elif t.exception() is not None:
+            # e.g. ImagePoolError: no verdict, score on text like a late image
+            timed_out.add(u)
+        else:
+            hex_hash = t.result()
+            hashes[u] = imagehash.hex_to_hash(hex_hash) if hex_hash else None
+
+    return hashes, timed_out
+
 def phash_similarity(hash1, hash2) -> float:
     """
     Compute similarity (0–100%) from two pHash values.
@@ -104,31 +240,11 @@ def norm(s: str) -> str:
       - Lowercase
       - Strip non-alphanumeric chars
       - Remove STOPWORDS
+    (memoized, see titles.analyze_title)
     """
-    if not s:
-        return ""
-    s = re.sub(r"[^a-z0-9 ]+", " ", s.lower())
-    toks = [t for t in s.split() if t and t not in STOPWORDS]
-    return " ".join(toks)
+    return analyze_title(s).norm
 
 # Size + Count Parsing (detect ounces, lbs, packs, ct, etc.)
-def _to_grams(val: float, unit: str) -> Optional[float]:
-    """Convert various units to grams (or ml equivalently for liquids)."""
-    u = unit.lower()
-    if u in {"lb", "lbs", "pound", "pounds"}:
-        return val * 453.59237
-    if u in {"oz", "ounce", "ounces"}:
-        return val * 28.349523125
-    if u == "kg":
-        return val * 1000.0
-    if u in {"g", "gram", "grams"}:
-        return val
-    if u == "ml":
-        return val
-    if u in {"l", "liter", "liters"}:
-        return val * 1000.0
-    return None
-
 def extract_size_and_count(title: str) -> Dict[str, Optional[float]]:
     """
     Parse sizes & pack counts from a product title.
@@ -139,26 +255,8 @@ def extract_size_and_count(title: str) -> Dict[str, Optional[float]]:
         "count": how many units (e.g., 2-pack)
       }
     """
-    grams = None
-    count = 1
-    if not title:
-        return {"grams": None, "count": 1}
-
-    for m in SIZE_RE.finditer(title):
-        qty, unit, pack_of, ct_alt, pack_alt = m.groups()
-
-        # Quantity+unit (e.g., "12 oz")
-        if qty and unit:
-            g = _to_grams(float(qty), unit)
-            if g:
-                grams = max(grams or 0, g)
-
-        # Handle pack sizes
-        for v in (pack_of, ct_alt, pack_alt):
-            if v and v.isdigit():
-                count = max(count, int(v))
-
-    return {"grams": grams, "count": count}
+    info = analyze_title(title)
+    return {"grams": info.grams, "count": info.count}
 
 def sizes_compatible(wm_title: str, amz_title: str, threshold: float = 0.85) -> bool:
     """
@@ -190,22 +288,128 @@ def extract_price_from_text(text: str) -> float:
     except:
         return None
 
+# Dashboard Savings (stored on each match doc, queried by /deals/google)
+DEAL_MIN_SAVINGS_ABS = 2.0
+DEAL_MIN_SAVINGS_PCT = 5.0
+
+def deal_savings(amz_price, offers: list) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Savings of the top offer vs. the Amazon price.
+
+    Returns (savings_abs in $, savings_pct 0–100), or (None, None)
+    when there is no offer or a price is missing.
+    """
+    if not offers or amz_price is None or offers[0].get("price") is None:
+        return None, None
+    amz = float(amz_price)
+    savings_abs = amz - float(offers[0]["price"])
+    savings_pct = (savings_abs / amz) * 100 if amz > 0 else 0.0
+    return round(savings_abs, 2), round(savings_pct, 2)
+
+# Batch Text Similarity (RapidFuzz cdist)
+# Offers below this token_set_ratio are rejected before image work
+TEXT_SIM_CUTOFF = 60
+# Threads used by cdist (-1 = all cores)
+TEXT_SIM_WORKERS = int(os.getenv("TEXT_SIM_WORKERS", "1"))
+
+def text_similarity_matrix(
+    amz_titles: List[str],
+    offer_titles: List[str],
+    score_cutoff: float = TEXT_SIM_CUTOFF,
+) -> np.ndarray:
+    """
+    Score every Amazon title against every offer title in one C-level call.
+
+    - Each title is normalized once (norm)
+    - Scores are fuzz.token_set_ratio (0–100)
+    - Scores below `score_cutoff` come back as 0
+
+    Returns a float32 matrix of shape (len(amz_titles), len(offer_titles)).
+    """
+    if not amz_titles or not offer_titles:
+        return np.zeros((len(amz_titles), len(offer_titles)), dtype=np.float32)
+
+    with scoring_stage_seconds.time("text_similarity"):
+        queries = [norm(t) for t in amz_titles]
+        choices = [norm(t) for t in offer_titles]
+
+        return process.cdist(
+            queries,
+            choices,
+            scorer=fuzz.token_set_ratio,
+            score_cutoff=score_cutoff,
+            dtype=np.float32,
+            workers=TEXT_SIM_WORKERS,
+        )
+
+# Candidate Ranking (merchant link resolution)
+def rank_candidates(
+    candidates: List[dict],
+    expected_title: str,
+    expected_price: Optional[float] = None,
+) -> List[dict]:
+    """
+    Score link candidates against the expected title/price in one batch.
+
+    Each candidate dict needs "title", "price" (or None) and its
+    "title_weight" / "price_weight". Score per candidate:
+      title_weight * fuzz.ratio(title, expected_title) / 100
+      + price_weight * max(0, 1 - |price - expected| / expected)
+
+    Returns copies of the candidates with "score", best first
+    (ties keep the input order).
+    """
+    if not candidates:
+        return []
+
+    expected = (expected_title or "").lower().strip()
+    titles = [(c.get("title") or "").lower() for c in candidates]
+
+    # One C-level call for every (expected, candidate) pair
+    title_sim = process.cdist(
+        [expected], titles, scorer=fuzz.ratio, dtype=np.float32, workers=TEXT_SIM_WORKERS
+    )[0] / 100.0
+
+    price_sim = np.zeros(len(candidates), dtype=np.float32)
+    if expected_price:
+        prices = np.array([c.get("price") or np.nan for c in candidates], dtype=np.float32)
+        diff_pct = np.abs(prices - expected_price) / max(expected_price, 1)
+        price_sim = np.nan_to_num(np.clip(1 - diff_pct, 0, None), nan=0.0)
+
+    title_w = np.array([c["title_weight"] for c in candidates], dtype=np.float32)
+    price_w = np.array([c["price_weight"] for c in candidates], dtype=np.float32)
+    scores = title_w * title_sim + price_w * price_sim
+
+    order = np.argsort(-scores, kind="stable")
+    return [{**candidates[i], "score": float(scores[i])} for i in order]
+
 # Deal Scoring Engine (shared by dashboard + Chrome extension)
-async def _score_offers_for_extension(payload: ExtensionFullProduct, all_offers: list[Offer]):
+async def _score_offers_for_extension(
+    payload: ExtensionFullProduct,
+    all_offers: list[Offer],
+    text_sims: Optional[np.ndarray] = None,
+    hashes: Optional[Dict[str, Optional[imagehash.ImageHash]]] = None,
+    timed_out: Optional[Set[str]] = None,
+):
     """
     Core scoring algorithm for Google Shopping offers:
     - Normalize Amazon title
-    - Compare text similarity (RapidFuzz)
-    - Compare images via pHash
+    - Compare text similarity (RapidFuzz, one batched cdist row;
+      pass `text_sims` to reuse a row from a larger matrix)
+    - Compare images via pHash (all thumbnails fetched concurrently;
+      offers whose images miss the deadline are scored on text alone;
+      pass `hashes`/`timed_out` to reuse a batch's compute_phashes result)
     - Adjust price using unit normalization where logical
     - Filter out weak matches
     - Compute savings
     - Return top 5 matches
+
+    Stage timings (images / match / total) -> scoring_stage_seconds.
     """
+    started = time.perf_counter()
 
     best_deals = []
 
-    amz_title_norm = norm(payload.title)
     amz_price = float(payload.price)
 
     # Parse Amazon size (for unit-normalized price matching)
@@ -223,26 +427,49 @@ async def _score_offers_for_extension(payload: ExtensionFullProduct, all_offers:
         amz_units = max(1, amz_count)
         amz_unit_mode = "count"
 
-    amazon_hash = await compute_phash(payload.thumbnail or payload.image_url)
+    # TEXT SIMILARITY (cheap, filters candidates before any image I/O)
+    if text_sims is None:
+        text_sims = text_similarity_matrix(
+            [payload.title], [o["title"] for o in all_offers]
+        )[0]
 
-    for o in all_offers:
-
-        # TEXT SIMILARITY
-        text_sim = fuzz.token_set_ratio(amz_title_norm, norm(o["title"]))
+    candidates = []
+    for o, text_sim in zip(all_offers, text_sims.tolist()):
         o["sim"] = text_sim
 
-        if text_sim < 60:  # reject weak matches early
+        if text_sim < TEXT_SIM_CUTOFF:  # reject weak matches early
             continue
 
+        candidates.append((o, text_sim))
+
+    # IMAGE HASHES (Amazon + every candidate, concurrently)
+    amazon_url = payload.thumbnail or payload.image_url
+    if hashes is None:
+        with scoring_stage_seconds.time("images"):
+            hashes, timed_out = await compute_phashes(
+                [amazon_url] + [o.get("thumbnail") for o, _ in candidates]
+            )
+    timed_out = timed_out or set()
+    amazon_hash = hashes.get(amazon_url)
+    match_started = time.perf_counter()
+
+    for o, text_sim in candidates:
+
         # IMAGE SIMILARITY
-        offer_hash = await compute_phash(o.get("thumbnail"))
+        offer_url = o.get("thumbnail")
+        offer_hash = hashes.get(offer_url)
+        image_checked = amazon_url not in timed_out and offer_url not in timed_out
 
         if amazon_hash and offer_hash:
             img_sim = phash_similarity(amazon_hash, offer_hash)
         else:
             img_sim = 0.0
 
-        combined_sim = (text_sim * 0.6) + (img_sim * 0.4)
+        if image_checked:
+            combined_sim = (text_sim * 0.6) + (img_sim * 0.4)
+        else:
+            # Image missed the deadline, fall back to text-only scoring
+            combined_sim = float(text_sim)
 
         if combined_sim < 55:
             continue
@@ -301,6 +528,7 @@ async def _score_offers_for_extension(payload: ExtensionFullProduct, all_offers:
             "brand": o.get("brand"),
             "sim": text_sim,
             "img_sim": img_sim,
+            "image_checked": image_checked,
             "combined_sim": combined_sim,
             "savings_abs": savings_abs,
             "savings_pct": savings_pct,
@@ -309,6 +537,10 @@ async def _score_offers_for_extension(payload: ExtensionFullProduct, all_offers:
     # Sort by strongest match + best savings
     best_deals.sort(key=lambda d: (d["combined_sim"], d["savings_abs"]), reverse=True)
 
+    now = time.perf_counter()
+    scoring_stage_seconds.observe(now - match_started, "match")
+    scoring_stage_seconds.observe(now - started, "total")
+
     return {
         "match_found": len(best_deals) > 0,
         "amazon": {
@@ -320,3 +552,38 @@ async def _score_offers_for_extension(payload: ExtensionFullProduct, all_offers:
         },
         "best_deals": best_deals[:5],
     }
+
+async def _score_offers_batch(
+    payloads: List[ExtensionFullProduct],
+    all_offers: list[Offer],
+    matrix: Optional[np.ndarray] = None,
+) -> List[dict]:
+    """
+    Score many Amazon products against ONE shared offer list.
+
+    Text similarity for every (product, offer) pair comes from a single
+    cdist call (or the caller's `matrix`). Images are hashed once for the
+    whole group: one compute_phashes call over every Amazon thumbnail plus
+    each offer thumbnail that passes TEXT_SIM_CUTOFF for at least one
+    product. Each row is then fed through the normal scoring engine with
+    those hashes. Results keep the order of `payloads`.
+    Offers are copied per product because scoring writes o["sim"].
+    """
+    if matrix is None:
+        matrix = text_similarity_matrix([p.title for p in payloads], [o["title"] for o in all_offers])
+
+    urls = [p.thumbnail or p.image_url for p in payloads]
+    if len(all_offers):
+        keep = (matrix >= TEXT_SIM_CUTOFF).any(axis=0)
+        urls += [o.get("thumbnail") for o, k in zip(all_offers, keep.tolist()) if k]
+
+    with scoring_stage_seconds.time("images"):
+        hashes, timed_out = await compute_phashes(urls)
+
+    return [
+        await _score_offers_for_extension(
+            p, [dict(o) for o in all_offers],
+            text_sims=matrix[i], hashes=hashes, timed_out=timed_out,
+        )
+        for i, p in enumerate(payloads)
+    ]